@@ -3,7 +3,9 @@
 import sys
 from seatable_api import Base, AirtableConvertor
 from airtable_importer_settings import server_url, api_token, airtable_api_key, airtable_base_id, \
-    table_names, first_columns, links
+    table_names, first_columns, links, import_workers, airtable_requests_per_second, import_state_dir
+
+from rows_import import RowsImporter
 
 
 def get_convertor():
@@ -25,20 +27,21 @@ def import_header():
     convertor.convert_metadata()
 
 
-def import_rows():
+def import_rows(resume=False):
     convertor = get_convertor()
-    convertor.convert_data()
+    importer = RowsImporter(convertor, import_state_dir, workers=import_workers,
+                            airtable_rate=airtable_requests_per_second)
+    return importer.run(resume=resume)
 
 
 if __name__ == '__main__':
-    argv_info = '\nusage :\npython3 airtable_importer.py { --import-header | --import-rows }\n'
-
-    if len(sys.argv) != 2:
-        print(argv_info)
+    argv_info = '\nusage :\npython3 airtable_importer.py { --import-header | --import-rows [--resume] }\n'
+
+    if len(sys.argv) == 2 and sys.argv[1] == '--import-header':
+        import_header()
+    elif len(sys.argv) == 2 and sys.argv[1] == '--import-rows':
+        import_rows()
+    elif len(sys.argv) == 3 and sys.argv[1] == '--import-rows' and sys.argv[2] == '--resume':
+        import_rows(resume=True)
     else:
-        if sys.argv[1] == '--import-header':
-            import_header()
-        elif sys.argv[1] == '--import-rows':
-            import_rows()
-        else:
-            print(argv_info)
+        print(argv_info)
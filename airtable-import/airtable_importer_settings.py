@@ -34,3 +34,10 @@ links = [
     ('Design projects', 'Client', 'Clients'),
     ('Design projects', 'Tasks', 'Tasks'),
 ]
+
+
+# rows import: tables imported in parallel and the Airtable limit of requests per second per base.
+# The progress is kept in import_state_dir, "--import-rows --resume" continues a stopped import
+import_workers = 4
+airtable_requests_per_second = 5
+import_state_dir = 'airtable_import_state'
@@ -0,0 +1,314 @@
+"""
+Replicate the changes of a base into MySQL tables from its socket.io feed.
+
+    feed = ChangeFeed(base, connect, tables={
+        'Orders': {'table': 'orders', 'columns': {'Order': 'order_no', 'Price': 'price'}},
+    })
+    base.socketIO.on(UPDATE_DTABLE, feed.on_update_dtable)
+    feed.start()
+
+The row events of a `window`, batch events expanded to one per row, are
+coalesced per row: an insert followed by modifications becomes one upsert of
+the merged cells, anything followed by a delete becomes a delete. The
+changes of a window are converted with the metadata of the base and written
+by `workers` threads with multi-row INSERT ... ON DUPLICATE KEY UPDATE and
+DELETE ... IN statements. The rows are
+sharded over the workers by row id, so the changes of a row are written in
+order.
+
+The MySQL tables need a primary or unique key on `key_column`, which holds the
+SeaTable row id. Only the mapped columns are written, a modification only
+writes the cells it changed.
+
+Table, column and option events, e.g. a column added or renamed, invalidate
+the MetadataCache and the metadata is fetched again once before the next
+window is converted. Link and view events are ignored, link columns are not
+replicated. Events are not replayed after a reconnect, a TableSync run or a
+full export fills such gaps.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_common.scheduler import backoff
+
+from metadata_cache import MetadataCache, is_schema_op
+
+logger = logging.getLogger(__name__)
+
+# can't connect, server gone away, lost connection, lock wait timeout, deadlock
+TRANSIENT_ERRNOS = (2003, 2006, 2013, 1205, 1213)
+
+INSERT_ROWS_OPS = ('insert_rows', 'append_rows')
+# where the batch insert operations keep the new rows
+ROWS_DATA_KEYS = ('rows_data', 'row_datas', 'rows')
+
+
+def get_changes(data):
+    """The changes of the rows of an UPDATE_DTABLE operation, the batch
+    operations of the batch_* calls expanded to one change per row.
+    The inserted rows are keyed by their own `_id`: the `row_id` of
+    insert_row is the row it was inserted next to. insert_rows and
+    append_rows rows without `_id` fall back to the order of `row_ids`,
+    modify_rows has the `updated` cells by row id and delete_rows the
+    `row_ids`. Other operations have no row changes.
+    """
+    op_type = data.get('op_type')
+    table_id = data.get('table_id')
+
+    def change(op, row_id, cells=None):
+        return {'op': op, 'table_id': table_id, 'row_id': row_id, 'cells': cells or {}}
+
+    if op_type == 'insert_row':
+        row = data.get('row_data') or {}
+        return [change('upsert', row['_id'], row)] if row.get('_id') else []
+    if op_type == 'modify_row':
+        return [change('upsert', data['row_id'], data.get('updated'))]
+    if op_type == 'delete_row':
+        return [change('delete', data['row_id'])]
+    if op_type in INSERT_ROWS_OPS:
+        rows = next((data[key] for key in ROWS_DATA_KEYS if isinstance(data.get(key), list)), [])
+        row_ids = data.get('row_ids') or []
+        changes = []
+        for i, row in enumerate(rows):
+            row_id = row.get('_id') or (row_ids[i] if i < len(row_ids) else None)
+            if row_id:
+                changes.append(change('upsert', row_id, row))
+        return changes
+    if op_type == 'modify_rows':
+        return [change('upsert', row_id, cells) for row_id, cells in (data.get('updated') or {}).items()]
+    if op_type == 'delete_rows':
+        return [change('delete', row_id) for row_id in data.get('row_ids') or []]
+    return []
+
+
+def is_transient(e):
+    """Whether a MySQL error is a lost connection or a lock wait timeout or
+    deadlock, that writing again resolves. pymysql raises OperationalError
+    for permanent errors too, e.g. an unknown column.
+    """
+    if isinstance(e, pymysql.InterfaceError):
+        # the connection was closed
+        return True
+    return bool(e.args) and e.args[0] in TRANSIENT_ERRNOS
+
+
+def merge(old, new):
+    """The change of a row after `old` and then `new`
+    """
+    if old is None or new['op'] == 'delete' or old['op'] == 'delete':
+        return new
+    return dict(new, cells=dict(old['cells'], **new['cells']))
+
+
+def to_value(value):
+    """The value to write to MySQL for a converted cell
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class ChangeFeed(object):
+
+    def __init__(self, base, connect, tables, key_column='_id', window=1, workers=4, batch_rows=1000,
+                 max_delay=60, cache=None):
+        """`connect()` returns a new pymysql connection, `tables` maps the names
+        of the tables to replicate to their MySQL `table` and `columns`, `cache`
+        is the MetadataCache of the base
+        """
+        self.base = base
+        self.connect = connect
+        self.tables = tables
+        self.key_column = key_column
+        self.window = window
+        self.workers = workers
+        self.batch_rows = batch_rows
+        self.max_delay = max_delay
+
+        # started with fresh metadata, the schema may have changed while the feed was not running
+        self.cache = cache or MetadataCache(base)
+        self.cache.refresh()
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.full = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        # one single threaded executor per shard keeps the order of the changes of a row
+        self.shards = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.local = threading.local()
+
+    def on_update_dtable(self, data, index, *args):
+        """UPDATE_DTABLE handler, only queues the change
+        """
+        data = json.loads(data) if isinstance(data, str) else data
+        if is_schema_op(data.get('op_type')):
+            # a change of the tables, columns or options, fetched again by the next window
+            self.cache.invalidate()
+            return
+        changes = get_changes(data)
+        if not changes:
+            return
+        with self.lock:
+            for change in changes:
+                key = (change['table_id'], change['row_id'])
+                self.pending[key] = merge(self.pending.get(key), change)
+            if len(self.pending) >= self.batch_rows * self.workers:
+                self.full.set()
+
+    def requeue(self, changes):
+        """Queue changes that could not be converted again, under the ones
+        that came since
+        """
+        with self.lock:
+            for change in changes:
+                key = (change['table_id'], change['row_id'])
+                newer = self.pending.get(key)
+                self.pending[key] = merge(change, newer) if newer else change
+
+    def convert(self, metadata, change):
+        """(table settings, row) of a change, None for a table not replicated
+        """
+        table = metadata.tables_by_id.get(change['table_id'])
+        if table is None or table['name'] not in self.tables:
+            return None
+        if change['op'] == 'delete':
+            return self.tables[table['name']], {'_id': change['row_id']}
+        return self.tables[table['name']], metadata.convert_cells(change['table_id'], change['cells'])
+
+    def split(self, metadata, changes):
+        """Convert the changes and split them into one list per shard. The
+        metadata is fetched again at most once, for a table, column or
+        option newer than it.
+        """
+        shards = [[] for _ in self.shards]
+        refreshed = False
+        for change in changes:
+            try:
+                converted = self.convert(metadata, change)
+            except KeyError as e:
+                if refreshed:
+                    logger.warning('cannot convert row %s: %s', change['row_id'], e)
+                    continue
+                metadata = self.cache.refresh()
+                refreshed = True
+                logger.info('metadata refreshed')
+                try:
+                    converted = self.convert(metadata, change)
+                except KeyError as e:
+                    logger.warning('cannot convert row %s: %s', change['row_id'], e)
+                    continue
+            if converted is not None:
+                shards[hash(change['row_id']) % len(shards)].append((change, converted))
+        return shards
+
+    def flush(self):
+        # the metadata first, while it cannot be fetched the changes stay queued
+        metadata = self.cache.get()
+        with self.lock:
+            changes, self.pending = list(self.pending.values()), {}
+            self.full.clear()
+        if not changes:
+            return
+        try:
+            shards = self.split(metadata, changes)
+        except Exception:
+            self.requeue(changes)
+            raise
+        for shard, items in zip(self.shards, shards):
+            if items:
+                shard.submit(self.write, items)
+
+    def get_connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connect()
+        return self.local.connection
+
+    def execute(self, items):
+        """Write the changes of a shard in one transaction
+        """
+        upserts, deletes = {}, {}
+        for change, (settings, row) in items:
+            if change['op'] == 'delete':
+                deletes.setdefault(settings['table'], []).append(row['_id'])
+                continue
+            cells = {column: to_value(row[name]) for name, column in settings['columns'].items() if name in row}
+            key = (settings['table'], tuple(sorted(cells)))
+            upserts.setdefault(key, []).append([change['row_id']] + [cells[column] for column in key[1]])
+
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            for (table, columns), values in upserts.items():
+                names = ', '.join('`%s`' % name for name in (self.key_column,) + columns)
+                updates = ', '.join('`%s` = VALUES(`%s`)' % (column, column) for column in columns) or \
+                    '`%s` = `%s`' % (self.key_column, self.key_column)
+                sql = 'INSERT INTO `%s` (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s' % (
+                    table, names, ', '.join(['%s'] * (len(columns) + 1)), updates)
+                for i in range(0, len(values), self.batch_rows):
+                    cursor.executemany(sql, values[i: i + self.batch_rows])
+            for table, row_ids in deletes.items():
+                for i in range(0, len(row_ids), self.batch_rows):
+                    row_id_split = row_ids[i: i + self.batch_rows]
+                    cursor.execute('DELETE FROM `%s` WHERE `%s` IN (%s)' % (
+                        table, self.key_column, ', '.join(['%s'] * len(row_id_split))), row_id_split)
+        connection.commit()
+
+    def write(self, items):
+        """Write the changes of a shard, retried until MySQL is back: the next
+        changes of the shard wait, so the rows stay in order. Changes MySQL
+        refuses are logged and dropped.
+        """
+        attempt = 0
+        while True:
+            try:
+                self.execute(items)
+                logger.info('wrote %s changes', len(items))
+                return
+            except pymysql.MySQLError as e:
+                if not is_transient(e):
+                    # e.g. an unknown column or a bad value, sending it again does not help
+                    logger.error('%s changes not written: %s', len(items), e)
+                    try:
+                        self.get_connection().rollback()
+                    except pymysql.MySQLError:
+                        self.local.connection = None
+                    return
+                attempt += 1
+                logger.warning('write %s changes error, retry: %s', len(items), e)
+                connection, self.local.connection = getattr(self.local, 'connection', None), None
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(backoff(attempt, max_delay=self.max_delay))
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.full.wait(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception('flush error: %s', e)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write the queued changes and stop
+        """
+        self.stopped.set()
+        self.full.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        for shard in self.shards:
+            shard.shutdown(wait=True)
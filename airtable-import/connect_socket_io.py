@@ -1,16 +1,22 @@
+import logging
+import pymysql
 from seatable_api import SeaTableAPI
 from seatable_api.constants import UPDATE_DTABLE, NEW_NOTIFICATION
-from seatable_api.utils import convert_row
+
+from change_feed import ChangeFeed
+from metadata_cache import MetadataCache
 
 server_url = 'http://127.0.0.1:8000'
 api_token = '678cdf2deba6e2abf5dc354938b717c45239629b'
 
+# mysql data
+mysql_config = {'host': 'localhost', 'user': '', 'password': '', 'db': 'seatable', 'charset': 'utf8mb4'}
 
-def on_update_seatable(data, index, *args):
-    """ You can overwrite this event
-    """
-    row = convert_row(metadata, data)
-    print(row)
+# tables replicated to mysql: {table name: {'table': mysql table, 'columns': {column name: mysql column}}}
+# every mysql table needs a primary key on `_id`, the SeaTable row id
+tables = {
+    'Table1': {'table': 'table1', 'columns': {'Name': 'name'}},
+}
 
 
 def on_new_notification(data, index, *args):
@@ -20,18 +26,24 @@ def on_new_notification(data, index, *args):
 
 
 def connect_socket_io():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
     seatable_api = SeaTableAPI(api_token, server_url)
     seatable_api.auth(with_socket_io=True)
 
-    global metadata
-    metadata = seatable_api.get_metadata()
+    # the row changes are coalesced for a second and written to mysql in batches
+    feed = ChangeFeed(seatable_api, lambda: pymysql.connect(**mysql_config), tables,
+                      cache=MetadataCache(seatable_api))
 
     # overwrite events
-    seatable_api.socketIO.on(UPDATE_DTABLE, on_update_seatable)
+    seatable_api.socketIO.on(UPDATE_DTABLE, feed.on_update_dtable)
     seatable_api.socketIO.on(NEW_NOTIFICATION, on_new_notification)
 
-    seatable_api.socketIO.wait()  # forever or limit (seconds=10)
+    feed.start()
+    try:
+        seatable_api.socketIO.wait()  # forever or limit (seconds=10)
+    finally:
+        feed.stop()
 
 
 if __name__ == '__main__':
@@ -1,99 +1,191 @@
+#!/usr/bin/env python3
+"""
+Export the images and files of a base to dir_name, one directory per table.
+
+usage: python3 file_download.py
+
+The files are downloaded by `workers` threads and streamed to disk in chunks.
+A manifest in dir_name records the finished files, so running the script
+again only downloads the files that are new or did not finish. Files with the
+same name get a ' (1)', ' (2)', ... suffix instead of overwriting each other.
+"""
 import os
+import json
 import uuid
+import threading
 from urllib import parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 from seatable_api import Base
 
+from row_iterator import iter_rows
+from metadata_cache import MetadataCache
+
 
-## replace server_url and api_token with your server address and api token 
+## replace server_url and api_token with your server address and api token
 server_url = 'https://cloud.seatable.io'
 api_token = '62374a03996cc365a977d1310bf8e099189db312'
 
-base = Base(api_token, server_url)
+dir_name = 'files'
+workers = 8
+# if you want to only download images change it to ('image',)
+file_types = ('image', 'file')
+
+MANIFEST_NAME = 'manifest.json'
+CHUNK_SIZE = 1024 * 1024
 
-base.auth()
+local = threading.local()
 
-####### checkout all file urls #######
 
-meta = base.get_metadata()
+def get_session():
+    """One requests session per thread, to keep the connections alive
+    """
+    if not hasattr(local, 'session'):
+        local.session = requests.Session()
+    return local.session
 
-tables = meta.get('tables', [])
 
-files = []
+def get_attachments(base):
+    """Yield the images and files of all tables: url, table, name and size
+    """
+    # a full export, fetched again so that no file column added since is missed
+    metadata = MetadataCache(base).refresh()
+    for table in metadata.tables:
+        file_cols = metadata.get_columns(table['name'], types=file_types)
+        if not file_cols:
+            continue
+        # only the image and file columns, page by page
+        for row in iter_rows(base, table['name'], columns=[col['name'] for col in file_cols]):
+            for col in file_cols:
+                for value in row.get(col.get('name')) or []:
+                    if col.get('type') == 'image':
+                        yield {'url': value, 'table': table['name'], 'name': None, 'size': None}
+                    elif value.get('url'):
+                        yield {'url': value['url'], 'table': table['name'],
+                               'name': value.get('name'), 'size': value.get('size')}
+
+
+def safe_name(name):
+    return name.replace('/', '_').replace('\\', '_').strip() or 'file'
+
+
+def get_file_path(attachment, taken):
+    """A path under dir_name that no other file uses yet
+    """
+    name = attachment['name'] or parse.unquote(attachment['url'].split('?')[0].rstrip('/').split('/')[-1])
+    path = os.path.join(safe_name(attachment['table']), safe_name(name))
+    root, ext = os.path.splitext(path)
+    no = 0
+    while path in taken:
+        no += 1
+        path = '%s (%s)%s' % (root, no, ext)
+    taken.add(path)
+    return path
+
+
+def load_manifest():
+    try:
+        with open(os.path.join(dir_name, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-for table in tables:
-    columns = table.get('columns', [])
-    # if you want to only download image just change following line to 
-    # file_cols = [col for col in columns if col.get('type') in ('image',)]
-    file_cols = [col for col in columns if col.get('type') in ('image', 'file')]
 
-    rows = base.list_rows(table.get('name'))
-    if not rows:
-        continue
+def save_manifest(manifest):
+    path = os.path.join(dir_name, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
 
-    for row in rows:
-        for col in file_cols:
-            if col.get('type') == 'image':
-                files.extend(row.get(col.get('name'), []))
-            elif col.get('type') == 'file':
-                col_files = row.get(col.get('name'), [])
-                files.extend([c_file.get('url') for c_file in col_files])
 
-print('total check images and files: ', len(files))
+def is_done(entry, attachment):
+    """Whether the file in the manifest is complete: it exists with the size
+    that was downloaded, and that the base records for it
+    """
+    if not entry.get('done'):
+        return False
+    try:
+        size = os.path.getsize(os.path.join(dir_name, entry['path']))
+    except OSError:
+        return False
+    return size == entry.get('size') and attachment['size'] in (None, size)
 
-####### confirm dir to save #######
 
-dir_name = 'files'
-no = 0
-while True:
-    if no == 0:
-        if not os.path.isdir(dir_name):
-            break
-    else:
-        if not os.path.isdir(dir_name + ' (%s)' % (no,)):
-            break
-    no += 1
-
-dir_name = dir_name if no == 0 else dir_name + ' (%s)' % (no,)
-
-####### download and save files one by one #######
-
-for index, file in enumerate(files, start=1):
-    print('start to download %s file/image' % (index,))
-    if str(uuid.UUID(base.dtable_uuid)) in file:
-        try:
-            if '/images/' in file:
-                path = parse.unquote(file[file.find('/images/'):])
-            elif '/files/' in file:
-                path = parse.unquote(file[file.find('/files/'):])
-            else:
-                print('fail to download %s file, url is invalid.' % (index,))
-                continue
-            file_url = base.get_file_download_link(path)
-            file_name = file_url.split('/')[-1]
-        except Exception as e:
-            print(e)
-            print('fail to download %s file' % (index,))
-            continue
-    else:
+def get_download_url(base, url):
+    if str(uuid.UUID(base.dtable_uuid)) not in url:
         # other non-uploaded file
-        file_url = file
-        file_name = file_url.split('?')[0].split('/')[-1]
-
-    try:
-        response = requests.get(file_url)
-    except Exception as e:
-        print('fail to download %s file/image' % (index,))
-        continue
-    if response.status_code != 200:
-        print('fail to download %s file/image' % (index,))
-        continue
-
-    if not os.path.isdir(dir_name):
-        os.mkdir(dir_name)
-
-    file_name = parse.unquote(file_name)
-    with open(os.path.join(dir_name, file_name), 'wb') as f:
-        f.write(response.content)
-
-    print('success to download %s file/image' % (index,))
+        return url
+    for prefix in ('/images/', '/files/'):
+        if prefix in url:
+            return base.get_file_download_link(parse.unquote(url[url.find(prefix):]))
+    raise ValueError('url is invalid: %s' % url)
+
+
+def download(base, attachment, entry):
+    """Stream the file to its path and return its manifest entry
+    """
+    headers = {}
+    path = os.path.join(dir_name, entry['path'])
+    if entry.get('etag') and attachment['size'] is None and os.path.exists(path):
+        # files from other servers have no size in the base, ask whether they changed
+        headers['If-None-Match'] = entry['etag']
+
+    response = get_session().get(get_download_url(base, attachment['url']), headers=headers, stream=True, timeout=60)
+    with response:
+        if response.status_code == 304:
+            return dict(entry, done=True, size=os.path.getsize(path))
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 0
+        with open(path + '.part', 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(path + '.part', path)
+    return dict(entry, done=True, size=size, etag=response.headers.get('ETag'))
+
+
+def file_download():
+    base = Base(api_token, server_url)
+    base.auth()
+
+    ####### checkout all file urls #######
+    attachments = {}
+    for attachment in get_attachments(base):
+        # a file copied to several rows is downloaded once
+        attachments.setdefault(attachment['url'], attachment)
+    print('total check images and files: ', len(attachments))
+
+    ####### names, from the manifest of a previous run first #######
+    os.makedirs(dir_name, exist_ok=True)
+    manifest = load_manifest()
+    taken = {entry['path'] for entry in manifest.values()}
+    for url, attachment in attachments.items():
+        if url not in manifest:
+            manifest[url] = {'path': get_file_path(attachment, taken)}
+    todo = [url for url, attachment in attachments.items() if not is_done(manifest[url], attachment)]
+    save_manifest(manifest)
+    print('%s files already downloaded, %s to download' % (len(attachments) - len(todo), len(todo)))
+
+    ####### download and save files in parallel #######
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(download, base, attachments[url], manifest[url]): url for url in todo}
+        for index, future in enumerate(as_completed(futures), start=1):
+            url = futures[future]
+            try:
+                manifest[url] = future.result()
+            except Exception as e:
+                failed += 1
+                print('fail to download %s: %s' % (url, e))
+            if index % 100 == 0:
+                save_manifest(manifest)
+                print('%s/%s files done' % (index, len(todo)))
+    save_manifest(manifest)
+    print('success to download %s files, %s failed' % (len(todo) - failed, failed))
+    if failed:
+        print('run the script again to retry the failed files')
+
+
+if __name__ == '__main__':
+    file_download()
@@ -0,0 +1,72 @@
+"""
+Link phase of the Airtable import, run once the rows of all tables are in.
+
+The Airtable ids of the linked records are mapped to SeaTable row ids with
+one in-memory map per table, built from the records of the rows phase, and
+the links of every ('table_name', 'column_name', 'other_table_name') tuple
+are set with batch_update_links requests of `batch_rows` rows. The tuples
+are linked in parallel, so linking takes one request per batch rather than
+one per link.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class LinksImporter(object):
+
+    def __init__(self, base, metadata, link_map, iter_records, scheduler, workers=4, batch_rows=1000):
+        """`metadata` is the Metadata of the base with the link columns,
+        `iter_records(table_name)` yields the records of the rows phase, dicts
+        with the Airtable `id`, the `row_id` and the `links` values
+        """
+        self.base = base
+        self.metadata = metadata
+        self.link_map = link_map
+        self.iter_records = iter_records
+        self.scheduler = scheduler
+        self.workers = workers
+        self.batch_rows = batch_rows
+
+    def get_row_id_maps(self):
+        """{table_name: {airtable id: row id}} of the tables that are linked to
+        """
+        table_names = {other_table_name for columns in self.link_map.values() for other_table_name in columns.values()}
+        return {table_name: {record['id']: record['row_id'] for record in self.iter_records(table_name)}
+                for table_name in table_names}
+
+    def link_column(self, table_name, column_name, other_row_ids):
+        link_data = self.metadata.get_column(table_name, column_name)['data']
+        other_rows_ids_map = {}
+        for record in self.iter_records(table_name):
+            other_ids = [other_row_ids[id] for id in record['links'].get(column_name, []) if id in other_row_ids]
+            if other_ids:
+                other_rows_ids_map[record['row_id']] = other_ids
+
+        row_ids = list(other_rows_ids_map)
+        for i in range(0, len(row_ids), self.batch_rows):
+            row_id_split = row_ids[i: i + self.batch_rows]
+            self.scheduler.call(self.base.batch_update_links, link_data['link_id'], link_data['table_id'],
+                                link_data['other_table_id'], row_id_split,
+                                {row_id: other_rows_ids_map[row_id] for row_id in row_id_split})
+        return sum(len(other_ids) for other_ids in other_rows_ids_map.values())
+
+    def run(self):
+        """Link all tuples and return the ones that failed
+        """
+        row_id_maps = self.get_row_id_maps()
+        tuples = [(table_name, column_name, other_table_name)
+                  for table_name, columns in self.link_map.items()
+                  for column_name, other_table_name in columns.items()]
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(tuples)))) as executor:
+            futures = {executor.submit(self.link_column, table_name, column_name, row_id_maps[other_table_name]):
+                       (table_name, column_name, other_table_name)
+                       for table_name, column_name, other_table_name in tuples}
+            for future in as_completed(futures):
+                table_name, column_name, other_table_name = futures[future]
+                try:
+                    print('[Info] Added [ %s ] links to column [ %s ] in table <%s>' % (
+                        future.result(), column_name, table_name))
+                except Exception as e:
+                    print('[Warning] link column [ %s ] in table <%s> error: %s' % (column_name, table_name, e))
+                    failed.append(futures[future])
+        return failed
@@ -0,0 +1,190 @@
+"""
+Metadata of a base, fetched once, indexed and cached on disk.
+
+    cache = MetadataCache(base)
+    metadata = cache.get()
+    link_id = metadata.get_link_id('Table1', 'Foreign Key')
+    file_columns = metadata.get_columns('Table1', types=('image', 'file'))
+
+Tables are indexed by name and id, columns by name, key and type, so the
+lookups do not scan the tables and columns. The metadata is kept in
+`cache_dir` for `ttl` seconds, so scripts that run again soon after do not
+download it again. A table, column or link that is not found is looked up
+once more in freshly fetched metadata, for tables and columns added or
+renamed since it was cached. A script that changes the columns, or that
+sees schema events on socket.io, calls invalidate() or refresh().
+"""
+import os
+import json
+import time
+import threading
+
+# bump when the cache file changes, older files are fetched again
+CACHE_VERSION = 1
+
+# column operations that do not change what the cells mean
+LAYOUT_OPS = ('resize_column', 'freeze_column', 'move_column')
+
+
+def is_schema_op(op_type):
+    """Whether an UPDATE_DTABLE operation changes the tables, columns or
+    select options, e.g. insert_table, rename_column or modify_column_type.
+    Row, link and view operations leave the metadata as it is.
+    """
+    if not op_type or op_type in LAYOUT_OPS:
+        return False
+    return any(word in op_type for word in ('table', 'column', 'option'))
+
+
+class Metadata(object):
+
+    def __init__(self, data, cache=None):
+        self.cache = cache
+        self.refreshed = False
+        self.index(data)
+
+    def index(self, data):
+        self.data = data
+        self.tables = data.get('tables') or []
+        self.tables_by_name = {table['name']: table for table in self.tables}
+        self.tables_by_id = {table['_id']: table for table in self.tables}
+        self.columns = {}
+        self.columns_by_key = {}
+        self.columns_by_type = {}
+        self.options = {}
+        for table in self.tables:
+            self.columns[table['_id']] = {column['name']: column for column in table['columns']}
+            self.columns_by_key[table['_id']] = {column['key']: column for column in table['columns']}
+            by_type = self.columns_by_type[table['_id']] = {}
+            for column in table['columns']:
+                by_type.setdefault(column['type'], []).append(column)
+                options = (column.get('data') or {}).get('options')
+                if column['type'] in ('single-select', 'multiple-select') and options:
+                    self.options[(table['_id'], column['key'])] = {option['id']: option['name'] for option in options}
+
+    def lookup(self, get):
+        """get(), with the metadata fetched again once when it raises
+        KeyError, for a table or column newer than the cached metadata
+        """
+        try:
+            return get()
+        except KeyError:
+            if self.cache is None or self.refreshed:
+                raise
+            self.refreshed = True
+            self.index(self.cache.refresh().data)
+            return get()
+
+    def get_table(self, table_name):
+        return self.lookup(lambda: self.tables_by_name[table_name])
+
+    def get_table_by_id(self, table_id):
+        return self.lookup(lambda: self.tables_by_id[table_id])
+
+    def get_column(self, table_name, column_name):
+        return self.lookup(lambda: self.columns[self.get_table(table_name)['_id']][column_name])
+
+    def get_column_by_key(self, table_id, column_key):
+        return self.columns_by_key[table_id][column_key]
+
+    def get_columns(self, table_name, types=None):
+        """The columns of a table, only the ones of `types` when given
+        """
+        table = self.get_table(table_name)
+        if types is None:
+            return table['columns']
+        by_type = self.columns_by_type[table['_id']]
+        return [column for column_type in types for column in by_type.get(column_type, [])]
+
+    def get_link_id(self, table_name, column_name):
+        return self.lookup(lambda: self.get_column(table_name, column_name)['data']['link_id'])
+
+    def convert_cells(self, table_id, cells):
+        """Cells of a socket.io row event by column name, select options by
+        name, like seatable_api.utils.convert_row. Raises KeyError for an
+        option that is newer than the metadata.
+        """
+        columns = self.columns_by_key[table_id]
+        row = {}
+        for column_key, value in cells.items():
+            column = columns.get(column_key)
+            if not column:
+                # inner data
+                continue
+            if column['type'] in ('single-select', 'multiple-select') and value:
+                options = self.options.get((table_id, column_key))
+                if not options:
+                    continue
+                if column['type'] == 'single-select':
+                    value = options[value]
+                else:
+                    value = [options[option_id] for option_id in value]
+            elif column['type'] == 'long-text':
+                value = value['text'] if value else ''
+            row[column['name']] = value
+        return row
+
+
+class MetadataCache(object):
+
+    def __init__(self, base, cache_dir='.metadata_cache', ttl=3600):
+        self.base = base
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.metadata = None
+        self.lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.cache_dir, '%s.json' % self.base.dtable_uuid)
+
+    def load(self):
+        """The metadata in the cache file, None if there is none or it is too old
+        """
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('cache_version') != CACHE_VERSION or time.time() - cached.get('fetched_at', 0) >= self.ttl:
+            return None
+        return Metadata(cached['metadata'], cache=self)
+
+    def fetch(self):
+        data = self.base.get_metadata()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'cache_version': CACHE_VERSION, 'fetched_at': time.time(), 'metadata': data}, f,
+                          ensure_ascii=False)
+            os.replace(self.path + '.tmp', self.path)
+        return Metadata(data, cache=self)
+
+    def get(self):
+        with self.lock:
+            if self.metadata is None:
+                self.metadata = self.load() or self.fetch()
+            return self.metadata
+
+    def invalidate(self):
+        with self.lock:
+            self.metadata = None
+            if self.cache_dir:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+
+    def refresh(self):
+        with self.lock:
+            self.metadata = self.fetch()
+            return self.metadata
+
+    def on_update_dtable(self, data, index, *args):
+        """UPDATE_DTABLE handler that invalidates the cache on schema events
+        """
+        data = json.loads(data) if isinstance(data, str) else data
+        if is_schema_op(data.get('op_type')):
+            self.invalidate()
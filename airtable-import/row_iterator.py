@@ -0,0 +1,71 @@
+"""
+Iterate over the rows of a table page by page, so that memory stays the same
+whatever the size of the table.
+
+    from row_iterator import iter_rows
+
+    for row in iter_rows(base, 'Table1', columns=['Name', 'Files']):
+        ...
+
+With `columns`, the pages are fetched by SQL through base.query and only the
+columns asked for are transferred; without, through base.list_rows with
+start and limit. The next page is fetched while the current one is used.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+# the server returns at most 1000 rows per list_rows request and 10000 per query
+PAGE_SIZE = 1000
+
+
+def iter_pages(fetch, page_size=PAGE_SIZE, prefetch=True):
+    """Yield the pages of `fetch(start, limit)` until a page is not full
+    """
+    if not prefetch:
+        start = 0
+        while True:
+            rows = fetch(start, page_size)
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            start += page_size
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        start = 0
+        future = executor.submit(fetch, start, page_size)
+        while True:
+            rows = future.result()
+            if len(rows) == page_size:
+                start += page_size
+                future = executor.submit(fetch, start, page_size)
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+
+
+def list_rows_page(base, table_name):
+    def fetch(start, limit):
+        return base.list_rows(table_name, start=start, limit=limit) or []
+    return fetch
+
+
+def query_page(base, table_name, columns):
+    # _id keeps the order stable between the pages and identifies the rows
+    names = ', '.join('`%s`' % name for name in ['_id'] + [name for name in columns if name != '_id'])
+
+    def fetch(start, limit):
+        sql = 'select %s from `%s` order by _id limit %s offset %s' % (names, table_name, limit, start)
+        return base.query(sql) or []
+    return fetch
+
+
+def iter_rows(base, table_name, columns=None, page_size=PAGE_SIZE, prefetch=True):
+    """Yield the rows of the table, only `_id` and `columns` when given
+    """
+    if columns:
+        fetch = query_page(base, table_name, columns)
+    else:
+        fetch = list_rows_page(base, table_name)
+    for rows in iter_pages(fetch, page_size, prefetch):
+        yield from rows
@@ -1,5 +1,7 @@
 from seatable_api import SeaTableAPI, Base
 
+from metadata_cache import MetadataCache
+
 server_url = 'http://127.0.0.1:8000'
 api_token = 'd67d4e0eeee24b55ff7b60595faed7e2df36e1d1'
 
@@ -21,22 +23,9 @@ def row_link():
     seatable = SeaTableAPI(api_token, server_url)
     seatable.auth()
 
-    # get column link id
-    metadata = seatable.get_metadata()
-
-    table = None
-    for table_item in metadata['tables']:
-        if table_item['name'] == table_name:
-            table = table_item
-            break
-
-    column = None
-    for column_item in table['columns']:
-        if column_item['name'] == column_name:
-            column = column_item
-            break
-
-    link_id = column['data']['link_id']
+    # get column link id, from the metadata cached by a previous run
+    metadata = MetadataCache(seatable).get()
+    link_id = metadata.get_link_id(table_name, column_name)
 
     # get row id
     rows = seatable.list_rows(table_name)
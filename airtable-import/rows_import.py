@@ -0,0 +1,180 @@
+"""
+Import the rows of the Airtable tables into SeaTable, the tables in parallel.
+
+Every table is read page by page from Airtable, within airtable_requests_per_second
+for all tables together, and every `batch_rows` rows are appended to SeaTable.
+After each append the Airtable offset of the table is saved to the checkpoint
+in state_dir, so an import that stopped continues with --resume instead of
+appending all rows again; at most the rows of the batch that was being
+appended are appended twice. Airtable offsets expire after a while, resume
+soon after a failure.
+
+Next to the checkpoint, '<table>.links.jsonl' records the Airtable id, the
+SeaTable row id and the link values of every appended row for the link
+phase, which runs once all tables are imported.
+"""
+import os
+import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_common.scheduler import RequestScheduler
+
+from links_import import LinksImporter
+from metadata_cache import Metadata
+
+SELECT_TYPES = ('single-select', 'multiple-select')
+
+
+class RowsImporter(object):
+
+    def __init__(self, convertor, state_dir, workers=4, airtable_rate=5, batch_rows=1000):
+        """`convertor` is the AirtableConvertor of the import, its Airtable
+        API, row conversion and table maps are reused
+        """
+        self.convertor = convertor
+        self.state_dir = state_dir
+        self.workers = workers
+        self.batch_rows = batch_rows
+        # one bucket for all tables: Airtable allows 5 requests per second per base
+        self.airtable = RequestScheduler(rate=airtable_rate, burst=1, max_in_flight=workers, base_delay=1,
+                                         max_delay=30)
+        self.seatable = RequestScheduler(max_in_flight=workers)
+        self.checkpoint = {}
+        self.lock = threading.Lock()
+
+    def get_path(self, name):
+        return os.path.join(self.state_dir, name.replace('/', '_'))
+
+    def links_path(self, table_name):
+        return self.get_path('%s.links.jsonl' % table_name)
+
+    def load_checkpoint(self):
+        try:
+            with open(self.get_path('checkpoint.json')) as f:
+                self.checkpoint = json.load(f)
+        except (OSError, ValueError):
+            self.checkpoint = {}
+
+    def save_table_state(self, table_name, state):
+        with self.lock:
+            self.checkpoint[table_name] = state
+            path = self.get_path('checkpoint.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.checkpoint, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+
+    def reset(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        for name in os.listdir(self.state_dir):
+            if name == 'checkpoint.json' or name.endswith('.links.jsonl'):
+                os.remove(os.path.join(self.state_dir, name))
+        self.checkpoint = {}
+
+    def iter_links(self, table_name):
+        """Yield the records of the link file of a table: id, row_id and links
+        """
+        try:
+            with open(self.links_path(table_name)) as f:
+                for line in f:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def get_select_options(self, table):
+        options = {}
+        for name, column in table.items():
+            if isinstance(column, dict) and column.get('type') in SELECT_TYPES:
+                options[name] = {option['name'] for option in (column.get('data') or {}).get('options') or []}
+        return options
+
+    def add_select_options(self, table_name, table, airtable_rows, options):
+        """Add the options of the page that the select columns do not have yet
+        """
+        for column in self.convertor.columns_parser.parse_select(table, airtable_rows):
+            known = options.setdefault(column['name'], set())
+            new_options = [option for option in column['options'] if option['name'] not in known]
+            if new_options:
+                self.seatable.call(self.convertor.base.add_column_options, table_name, column['name'], new_options)
+                known.update(option['name'] for option in new_options)
+
+    def append(self, table_name, airtable_rows):
+        columns = self.convertor.column_map[table_name]
+        link_columns = list(self.convertor.link_map.get(table_name, {}))
+        rows = self.convertor.rows_convertor.convert(columns, airtable_rows)
+        result = self.seatable.call(self.convertor.base.batch_append_rows, table_name, rows)
+        row_ids = (result or {}).get('row_ids') or []
+        if len(row_ids) != len(rows):
+            # the rows keep the Airtable id as _id
+            row_ids = [{'_id': row['_id']} for row in rows]
+        with open(self.links_path(table_name), 'a') as f:
+            for airtable_row, row_id in zip(airtable_rows, row_ids):
+                links = {column: airtable_row[column] for column in link_columns if airtable_row.get(column)}
+                f.write(json.dumps({'id': airtable_row['_id'], 'row_id': row_id.get('_id'), 'links': links}) + '\n')
+        print('[Info] Appended [ %s ] rows to table <%s>' % (len(rows), table_name))
+
+    def import_table(self, table_name):
+        state = dict(self.checkpoint.get(table_name) or {'offset': '', 'rows': 0, 'done': False})
+        if state['done']:
+            print('[Info] Table <%s> already imported, skip' % table_name)
+            return state['rows']
+        table = self.convertor.table_map[table_name]
+        options = self.get_select_options(table)
+
+        offset = state['offset']
+        pending = []
+        while True:
+            airtable_rows, offset = self.airtable.call(self.convertor.airtable_api.list_rows, table_name, offset)
+            self.add_select_options(table_name, table, airtable_rows, options)
+            pending.extend(airtable_rows)
+            if pending and (len(pending) >= self.batch_rows or not offset):
+                self.append(table_name, pending)
+                state = {'offset': offset or '', 'rows': state['rows'] + len(pending), 'done': not offset}
+                self.save_table_state(table_name, state)
+                pending = []
+            if not offset:
+                break
+        self.save_table_state(table_name, dict(state, done=True))
+        return state['rows']
+
+    def run(self, resume=False):
+        """Import the rows of all tables, then the links, and return whether
+        everything was imported
+        """
+        if resume:
+            self.load_checkpoint()
+        else:
+            self.reset()
+            self.convertor.delete_demo_rows()
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.convertor.get_table_map()
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(self.convertor.table_names)))) as executor:
+            futures = {executor.submit(self.import_table, table_name): table_name
+                       for table_name in self.convertor.table_names}
+            for future in as_completed(futures):
+                table_name = futures[future]
+                try:
+                    print('[Info] Imported [ %s ] rows to table <%s>' % (future.result(), table_name))
+                except Exception as e:
+                    print('[Warning] import table <%s> error: %s' % (table_name, e))
+                    failed.append(table_name)
+        if failed:
+            print('[Warning] %s tables not imported, run again with --resume: %s' % (len(failed), ', '.join(failed)))
+            return False
+
+        print('[Info] Convert links')
+        # the metadata get_table_map() fetched, after the link columns were added
+        metadata = Metadata({'tables': self.convertor.tables})
+        links_importer = LinksImporter(self.convertor.base, metadata, self.convertor.link_map,
+                                       self.iter_links, self.seatable, workers=self.workers)
+        failed = links_importer.run()
+        if failed:
+            # setting links is idempotent, a resume links all tuples again
+            print('[Warning] %s link columns not linked, run again with --resume' % len(failed))
+            return False
+        print('[Info] Success\n')
+        return True
@@ -1,6 +1,8 @@
 import pymysql
 from seatable_api import SeaTableAPI
 
+from table_sync import TableSync
+
 server_url = 'http://127.0.0.1:8000'
 api_token = '48b6a41a0c2e1ee4bf294ed42445914025a0a60c'
 
@@ -13,8 +15,6 @@ def sync_mysql():
     seatable.auth()
 
     table_name = 'Table1'
-    rows = seatable.list_rows(table_name)
-    row_keys = [row.get('Name') for row in rows]
 
     # mysql data
     host = 'localhost'
@@ -23,18 +23,14 @@ def sync_mysql():
     db = 'seatable'
     connection = pymysql.connect(host=host, user=user, password=password, db=db)
 
-    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
-        sql = "SELECT * FROM order"
-        cursor.execute(sql)
-        mysql_data = cursor.fetchall()
-
-    # sync
-    for item in mysql_data:
-        if item.get('name') not in row_keys:
-            row_data = {
-                'Name': item.get('name'),
-            }
-            seatable.append_row(table_name, row_data)
+    # sync: the rows are matched by `name`, new ones are appended and changed
+    # ones updated. Set updated_at='updated_at' to only read the rows changed
+    # since the last run, or delete=True to remove the rows no longer in mysql
+    table_sync = TableSync(seatable, table_name, keys=['name'], columns={'name': 'Name'})
+    try:
+        table_sync.run(connection, "SELECT * FROM `order`")
+    finally:
+        connection.close()
 
 
 if __name__ == '__main__':
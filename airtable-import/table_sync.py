@@ -0,0 +1,189 @@
+"""
+Sync the result of an SQL query on MySQL into a SeaTable table.
+
+    table_sync = TableSync(base, 'Orders', keys=['order_no'],
+                           columns={'order_no': 'Order', 'price': 'Price'})
+    table_sync.run(connection, 'SELECT order_no, price FROM `order`')
+
+The keys and values of the table are read once, page by page, into a hash
+index. The query result is streamed and every row is compared against it:
+new keys are appended, changed values are updated and, with delete=True,
+rows whose key is no longer returned by the query are deleted, all with
+batch requests of `step` rows.
+
+With `updated_at`, the name of a source datetime column, a run only reads
+the source rows changed since the last run; the checkpoint is kept in
+`state_path`. It is the database time `margin` seconds before the run
+started reading, so rows committed during the run, or late by a transaction
+that started before it, are read again by the next run and found unchanged
+when they were synced. Incremental runs do not see removed source rows, so
+they never delete.
+"""
+import os
+import re
+import json
+import logging
+import pymysql
+from decimal import Decimal
+from datetime import date, datetime
+
+from row_iterator import iter_rows
+
+logger = logging.getLogger(__name__)
+
+TIME = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}')
+
+
+def to_cell(value):
+    """The value to write to SeaTable for a MySQL value
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return str(value)
+    return value
+
+
+def normalize(value):
+    """Comparable form of a source or a SeaTable value: numbers as float,
+    times to the minute SeaTable shows, empty values as None
+    """
+    if value is None or value == '' or value == []:
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        value = str(value)
+    if isinstance(value, str) and TIME.match(value):
+        return value[:16].replace('T', ' ')
+    return value
+
+
+class TableSync(object):
+
+    def __init__(self, base, table_name, keys, columns, updated_at=None, delete=False, step=1000,
+                 state_path='table_sync_state.json', margin=300):
+        """`keys` are source columns that identify a row, `columns` maps the
+        source columns to the table columns and has to include the keys
+        """
+        self.base = base
+        self.table_name = table_name
+        self.keys = keys
+        self.columns = columns
+        self.updated_at = updated_at
+        self.delete = delete
+        self.step = step
+        self.state_path = state_path
+        self.margin = margin
+        self.appends = []
+        self.updates = []
+        self.counts = {'append': 0, 'update': 0, 'delete': 0, 'unchanged': 0}
+
+    def get_key(self, row, columns=None):
+        return tuple(normalize(row.get(columns[key] if columns else key)) for key in self.keys)
+
+    def get_values(self, row, columns=None):
+        return tuple(normalize(row.get(columns[column] if columns else column)) for column in self.columns)
+
+    def load_target(self):
+        """Return {key: (row_id, values)} of the rows in the table
+        """
+        target = {}
+        for row in iter_rows(self.base, self.table_name, columns=list(self.columns.values()), page_size=self.step):
+            target[self.get_key(row, self.columns)] = (row['_id'], self.get_values(row, self.columns))
+        return target
+
+    def load_checkpoint(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get(self.table_name)
+        except (OSError, ValueError):
+            return None
+
+    def save_checkpoint(self, checkpoint):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state[self.table_name] = checkpoint
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def get_watermark(self, conn):
+        """The checkpoint of this run: the database time `margin` seconds
+        before it starts reading
+        """
+        with conn.cursor(pymysql.cursors.Cursor) as cursor:
+            cursor.execute('SELECT NOW() - INTERVAL %s SECOND', (self.margin,))
+            return str(cursor.fetchone()[0])
+
+    def iter_source(self, conn, sql, checkpoint):
+        """Stream the rows of the query, only the changed ones after a checkpoint
+        """
+        args = None
+        if checkpoint is not None:
+            sql = 'SELECT * FROM (%s) AS source WHERE source.`%s` >= %%s' % (sql.rstrip().rstrip(';'), self.updated_at)
+            args = (checkpoint,)
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(self.step)
+                if not rows:
+                    break
+                yield from rows
+
+    def flush(self, force=False):
+        if self.appends and (force or len(self.appends) >= self.step):
+            self.base.batch_append_rows(self.table_name, self.appends)
+            self.counts['append'] += len(self.appends)
+            self.appends = []
+        if self.updates and (force or len(self.updates) >= self.step):
+            self.base.batch_update_rows(self.table_name, self.updates)
+            self.counts['update'] += len(self.updates)
+            self.updates = []
+
+    def run(self, conn, sql):
+        """Sync the rows of `sql` into the table and return the counts of
+        appended, updated, deleted and unchanged rows
+        """
+        checkpoint = self.load_checkpoint() if self.updated_at else None
+        watermark = self.get_watermark(conn) if self.updated_at else None
+        target = self.load_target()
+        logger.info('%s rows in %s', len(target), self.table_name)
+
+        seen = set()
+        for source_row in self.iter_source(conn, sql, checkpoint):
+            key = self.get_key(source_row)
+            if key in seen:
+                logger.warning('duplicate key %s, only the first row is synced', key)
+                continue
+            seen.add(key)
+
+            synced = target.get(key)
+            if synced is None:
+                self.appends.append({self.columns[column]: to_cell(source_row.get(column)) for column in self.columns})
+            elif synced[1] != self.get_values(source_row):
+                self.updates.append({
+                    'row_id': synced[0],
+                    'row': {self.columns[column]: to_cell(source_row.get(column)) for column in self.columns}
+                })
+            else:
+                self.counts['unchanged'] += 1
+            self.flush()
+        self.flush(force=True)
+
+        if self.delete and checkpoint is None:
+            row_ids = [row_id for key, (row_id, _) in target.items() if key not in seen]
+            for i in range(0, len(row_ids), self.step):
+                self.base.batch_delete_rows(self.table_name, row_ids[i: i + self.step])
+            self.counts['delete'] = len(row_ids)
+
+        # saved once the run is complete, a failed run starts again from the old checkpoint
+        if watermark:
+            self.save_checkpoint(watermark)
+        logger.info('sync %s: %s', self.table_name, self.counts)
+        return self.counts
@@ -1,64 +1,227 @@
+#!/usr/bin/env python3
+"""
+Upload many files to the file or image column of a table.
+
+usage: python3 upload_file.py
+
+`source` is either a directory or a CSV manifest with a `key` and a `path`
+column. In a directory, a file is added to the row whose `key_column` is the
+file name without extension, and the files in a subdirectory to the row whose
+key is the name of the subdirectory.
+
+The rows are looked up once, only the key and the file column, page by page.
+The files are uploaded by `workers` threads and streamed from disk in chunks,
+all with the same upload link until it expires. The new cells are written with
+batch_update_rows requests of `step` rows, the files are added to the files
+the rows already have.
+"""
 import os
-import sys
-import json
-import requests
+import csv
+import time
+import uuid
+import threading
+from urllib import parse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from seatable_api import Base
 
-from seatable_api import SeaTableAPI
+from row_iterator import iter_rows
+from metadata_cache import MetadataCache
 
 
+## replace server_url and api_token with your server address and api token
 server_url = 'http://127.0.0.1:8000'
 api_token = 'd67d4e0eeee24b55ff7b60595faed7e2df36e1d1'
 
-
-def upload_file():
-
-    seatable = SeaTableAPI(api_token, server_url)
-    seatable.auth()
-
-    table_name = 'Table1'
-    file_name = 'demo.zip'
-    file_path = '/tmp/demo.zip'
-    file_column_name = '文件'
-    WORKSPACE_ID = 9
-
-    relative_path = 'files/' + datetime.now().strftime('%Y-%m')
-
-    rows = seatable.list_rows(table_name)
-    row = rows[0]
-    row_id = row['_id']
-
-    upload_url_data = seatable.get_file_upload_link()
-    upload_url = upload_url_data.get('upload_link') + '?ret-json=1'
-    parent_dir = upload_url_data.get('parent_path')
-
-    data = {
-        'parent_dir': parent_dir,
-        'relative_path': relative_path,
-    }
-    files = {'file': (file_name, open(file_path, 'rb'))}
-    resp = requests.post(upload_url, data=data, files=files)
-
-    resp_json = json.loads(resp.text)
-    name = resp_json[0]['name']
-    size = resp_json[0]['size']
-    url = server_url.rstrip('/') + '/workspace/' + str(WORKSPACE_ID) + \
-        parent_dir + '/' + relative_path + '/' + name
-
-    file_data = {
-        'name': name,
-        'size': size,
-        'type': 'file',
-        'url': url,
+table_name = 'Table1'
+key_column = 'Name'
+file_column = '文件'
+source = '/tmp/files'
+workers = 8
+step = 1000
+
+CHUNK_SIZE = 1024 * 1024
+# upload links are valid for an hour, a new one is asked for well before
+UPLOAD_LINK_TTL = 30 * 60
+
+local = threading.local()
+
+
+def get_session():
+    """One requests session per thread, to keep the connections alive
+    """
+    if not hasattr(local, 'session'):
+        local.session = requests.Session()
+    return local.session
+
+
+def get_files(source):
+    """Yield (key, path) of the files to upload
+    """
+    if os.path.isfile(source):
+        with open(source, newline='') as f:
+            for line in csv.DictReader(f):
+                yield line['key'], line['path']
+        return
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, file_name)):
+                    yield name, os.path.join(path, file_name)
+        else:
+            yield os.path.splitext(name)[0], path
+
+
+class UploadLink(object):
+    """The upload link shared by the workers, asked for again once it expires
+    or the server refuses it
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.lock = threading.Lock()
+        self.data = None
+        self.expire = 0
+
+    def get(self):
+        with self.lock:
+            if self.data is None or time.time() >= self.expire:
+                self.data = self.base.get_file_upload_link()
+                self.expire = time.time() + UPLOAD_LINK_TTL
+            return self.data
+
+    def invalidate(self, data):
+        with self.lock:
+            if self.data is data:
+                self.data = None
+
+
+class MultipartBody(object):
+    """A multipart/form-data body that reads the file while it is sent,
+    instead of loading it into memory
+    """
+
+    def __init__(self, fields, file_name, path):
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for name, value in fields.items():
+            head += ('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (
+                self.boundary, name, value)).encode('utf-8')
+        head += ('--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\n'
+                 'Content-Type: application/octet-stream\r\n\r\n' % (
+                     self.boundary, file_name.replace('"', '%22'))).encode('utf-8')
+        self.parts = [head, None, ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')]
+        self.length = len(head) + os.path.getsize(path) + len(self.parts[2])
+        self.file = open(path, 'rb')
+        self.buffer = b''
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        size = CHUNK_SIZE if size is None or size < 0 else size
+        while len(self.buffer) < size and self.parts:
+            part = self.parts[0]
+            if part is None:
+                chunk = self.file.read(CHUNK_SIZE)
+                if chunk:
+                    self.buffer += chunk
+                    continue
+            else:
+                self.buffer += part
+            self.parts.pop(0)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_relative_path(column_type):
+    return '%s/%s' % ('images' if column_type == 'image' else 'files', datetime.now().strftime('%Y-%m'))
+
+
+def upload(base, upload_link, path, column_type):
+    """Upload the file and return its cell value
+    """
+    relative_path = get_relative_path(column_type)
+    for attempt in range(2):
+        link = upload_link.get()
+        body = MultipartBody({'parent_dir': link['parent_path'], 'relative_path': relative_path, 'replace': 0},
+                             os.path.basename(path), path)
+        try:
+            response = get_session().post(link['upload_link'] + '?ret-json=1', data=body,
+                                          headers={'Content-Type': body.content_type}, timeout=600)
+        finally:
+            body.close()
+        if response.status_code in (401, 403) and attempt == 0:
+            # the link expired before its time
+            upload_link.invalidate(link)
+            continue
+        response.raise_for_status()
+        break
+    d = response.json()[0]
+    url = '%(server)s/workspace/%(workspace_id)s/asset/%(dtable_uuid)s/%(relative_path)s/%(filename)s' % {
+        'server': base.server_url.strip('/'),
+        'workspace_id': base.workspace_id,
+        'dtable_uuid': str(uuid.UUID(base.dtable_uuid)),
+        'relative_path': parse.quote(relative_path),
+        'filename': parse.quote(d['name']),
     }
+    if column_type == 'image':
+        return url
+    return {'name': d['name'], 'size': d['size'], 'type': 'file', 'url': url}
 
-    files_data = row.get(file_column_name) or []
-    files_data.append(file_data)
 
-    row_data = {
-        file_column_name: files_data,
-    }
-    seatable.update_row(table_name, row_id, row_data)
+def upload_file():
+    base = Base(api_token, server_url)
+    base.auth()
+
+    column_type = MetadataCache(base).get().get_column(table_name, file_column)['type']
+
+    ####### files and the rows they go to #######
+    files = list(get_files(source))
+    keys = {key for key, _ in files}
+    rows = {}
+    for row in iter_rows(base, table_name, columns=[key_column, file_column]):
+        key = str(row.get(key_column))
+        if key in keys and key not in rows:
+            rows[key] = {'row_id': row['_id'], 'cells': row.get(file_column) or []}
+    missing = [path for key, path in files if key not in rows]
+    for path in missing:
+        print('no row for %s' % path)
+    files = [(key, path) for key, path in files if key in rows]
+    print('total files to upload: ', len(files))
+
+    ####### upload files in parallel #######
+    upload_link = UploadLink(base)
+    failed = 0
+    changed = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(upload, base, upload_link, path, column_type): (key, path) for key, path in files}
+        for index, future in enumerate(as_completed(futures), start=1):
+            key, path = futures[future]
+            try:
+                rows[key]['cells'].append(future.result())
+                changed[key] = rows[key]
+            except Exception as e:
+                failed += 1
+                print('fail to upload %s: %s' % (path, e))
+            if index % 100 == 0:
+                print('%s/%s files uploaded' % (index, len(files)))
+
+    ####### write the cells #######
+    updates = [{'row_id': row['row_id'], 'row': {file_column: row['cells']}} for row in changed.values()]
+    for i in range(0, len(updates), step):
+        base.batch_update_rows(table_name, updates[i: i + step])
+    print('success to upload %s files to %s rows, %s failed, %s without row' % (
+        len(files) - failed, len(updates), failed, len(missing)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Sync the dtables created in a date range, e.g. to catch up on missed days.
+
+usage: python3 backfill.py START_DATE END_DATE [SHARD_DAYS]
+
+The range is split into shards of SHARD_DAYS days (default 1) that are synced
+concurrently, sharing one authenticated base and a pool of MySQL connections.
+Finished shards are recorded in the uuid index, so running the same command
+again after a failure only retries the shards that did not finish.
+"""
+import sys
+import time
+import queue
+import logging
+import pymysql
+import settings
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from seatable_api import Base
+
+from base_syncer import iter_dtables, open_index, sync_pages
+from sync_common import metrics
+from sync_common.scheduler import RequestScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """A fixed number of MySQL connections, opened on first use
+    """
+
+    def __init__(self, size, **kwargs):
+        self.kwargs = kwargs
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(None)
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            if conn is None:
+                conn = pymysql.connect(**self.kwargs)
+            else:
+                conn.ping(reconnect=True)
+            yield conn
+        except Exception:
+            if conn is not None:
+                conn.close()
+                conn = None
+            raise
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            conn = self.connections.get()
+            if conn is not None:
+                conn.close()
+
+
+def get_shards(start, end, shard_days=1):
+    """Split the days from `start` to `end`, both included, into (first, last) day shards
+    """
+    if shard_days < 1:
+        raise ValueError('shard_days must be at least 1, got %s' % shard_days)
+    shards = []
+    day = start
+    while day <= end:
+        last = min(day + timedelta(days=shard_days - 1), end)
+        shards.append((day, last))
+        day = last + timedelta(days=1)
+    return shards
+
+
+def backfill(start, end, table_name, username, password, db_name, host, charset, api_token, dtable_web_service_url,
+             index_path, shard_days=1, workers=4, max_in_flight=4, queue_size=8, requests_per_second=0):
+    base = Base(api_token, dtable_web_service_url)
+    base.auth()
+    logger.info('api_token: %s, dtable_web_service_url: %s auth successfully!', api_token, dtable_web_service_url)
+
+    # one scheduler for all shards, so the SeaTable load does not grow with workers
+    scheduler = RequestScheduler(rate=requests_per_second, max_in_flight=max_in_flight)
+    index = open_index(base, table_name, index_path, scheduler)
+    pool = ConnectionPool(workers, user=username, password=password, database=db_name, host=host, charset=charset)
+
+    shards = []
+    for first, last in get_shards(start, end, shard_days):
+        shard = '%s~%s' % (first, last)
+        if index.is_shard_synced(table_name, shard):
+            logger.info('shard %s already synced, skip', shard)
+            continue
+        shards.append((shard, first, last))
+
+    def sync_shard(first, last):
+        with pool.connection() as conn:
+            source = iter_dtables(conn, where="d.created_at >= %s AND d.created_at < %s",
+                                  args=(str(first), str(last + timedelta(days=1))))
+            return sync_pages(base, table_name, source, scheduler, index=index,
+                              queue_size=queue_size, workers=max_in_flight)
+
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(sync_shard, first, last): shard for shard, first, last in shards}
+            for done, future in enumerate(as_completed(futures), start=1):
+                shard = futures[future]
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    logger.exception(e)
+                    logger.error('shard %s failed (%s/%s): %s', shard, done, len(shards), e)
+                    failed.append(shard)
+                    continue
+                index.set_shard_synced(table_name, shard)
+                logger.info('shard %s synced (%s/%s): %s new, %s updated',
+                            shard, done, len(shards), counts['append'], counts['update'])
+    finally:
+        pool.close()
+        index.close()
+    return failed
+
+
+def main():
+    usage = '\nusage :\npython3 backfill.py START_DATE END_DATE [SHARD_DAYS]\n'
+    if len(sys.argv) not in (3, 4):
+        print(usage)
+        return 1
+    try:
+        start = datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+        end = datetime.strptime(sys.argv[2], '%Y-%m-%d').date()
+        shard_days = int(sys.argv[3]) if len(sys.argv) == 4 else 1
+    except ValueError:
+        print(usage)
+        return 1
+    if shard_days < 1:
+        print(usage)
+        return 1
+    if not settings.UUID_INDEX_PATH:
+        logger.error('backfill records the finished shards in the uuid index, UUID_INDEX_PATH is required')
+        return 1
+
+    if settings.METRICS_PORT:
+        metrics.serve(settings.METRICS_PORT)
+    start_time = time.time()
+    failed = backfill(
+        start, end,
+        table_name=settings.BASE_TABLE_NAME,
+        username=settings.MYSQL_USER,
+        password=settings.MYSQL_PASSWORD,
+        db_name=settings.DB_NAME,
+        host=settings.MYSQL_HOST,
+        charset=settings.CHARSET,
+        api_token=settings.BASE_API_TOKEN,
+        dtable_web_service_url=settings.DTABLE_WEB_SERVICE_URL,
+        index_path=settings.UUID_INDEX_PATH,
+        shard_days=shard_days,
+        workers=settings.BACKFILL_WORKERS,
+        max_in_flight=settings.MAX_IN_FLIGHT_REQUESTS,
+        queue_size=settings.PIPELINE_QUEUE_SIZE,
+        requests_per_second=settings.REQUESTS_PER_SECOND)
+    logger.info('backfill %s ~ %s finished in %.1fs', start, end, time.time() - start_time)
+    if failed:
+        logger.error('%s shards failed, run the same command again to retry them: %s', len(failed), ', '.join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,24 @@
+import os
+import re
+import sys
+import json
 import time
 import pymysql
+import hashlib
 import logging
+import itertools
+import threading
 import settings
-from datetime import datetime
+from datetime import datetime, timedelta
 from seatable_api import Base
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_common import metrics
+
+from pipeline import Pipeline
+from sync_common.scheduler import RequestScheduler, backoff, is_retryable
+from uuid_index import UuidIndex
+
 logging.basicConfig(
     filename='base_syncer.log',
     filemode='a',
@@ -13,56 +27,213 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# the dtables columns written to the table, see get_row
+SYNCED_COLUMNS = ('uuid', 'name', 'creator', 'created_at', 'workspace_id', 'deleted')
+
+TIME_VALUE = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}')
+
 
-def get_dtables(base, mode, cursor, table_name, date=None):
-    sql = "SELECT uuid,name,creator,created_at,workspace_id,deleted FROM dtables"
+def get_dtables_filter(mode, date=None):
+    """Return the where clause, and its args, that selects the dtables of `mode`
+    """
     if mode == 'ON':
         if not date:
-            date = 'curdate()'
-        else:
-            date = "'%s'" % date
-        sql += " WHERE DATE(created_at) = DATE_SUB(%s,interval 1 day)" % date
-    mysql_rows = []
-    step = 1000
-    i = 0
-    email_nike_map = dict()
+            return "DATE(d.created_at) = DATE_SUB(curdate(),interval 1 day)", ()
+        return "DATE(d.created_at) = DATE_SUB(%s,interval 1 day)", (date,)
+    return None, ()
+
+
+def iter_dtables(conn, where=None, args=(), start_id=0, step=1000):
+    """Yield pages of dtables rows, paging by primary key instead of OFFSET
+    so that every page costs the same no matter how deep into the table it is.
+    """
+    # creators are resolved by the join, not by one profile query per page
+    sql = "SELECT d.id,d.uuid,d.name,d.creator,d.created_at,d.updated_at,d.workspace_id,d.deleted," \
+          "p.`user` AS profile_user,p.`nickname` FROM dtables d " \
+          "LEFT JOIN `profile_profile` p ON p.`user` = d.creator WHERE d.id > %s"
+    if where:
+        sql += " AND " + where
+    sql += " ORDER BY d.id LIMIT %s"
+
+    last_id = start_id
     while True:
-        query_sql = sql + f" LIMIT {i * step},{step}"
-        cursor.execute(query_sql)
-        rows = cursor.fetchall()
-        user_list = list(set([row['creator'] for row in rows]))
-        if not user_list:
+        cursor = conn.cursor(cursor=pymysql.cursors.SSDictCursor)
+        try:
+            with metrics.timed('mysql_fetch'):
+                cursor.execute(sql, args=(last_id,) + tuple(args) + (step,))
+                rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        if not rows:
             break
-        profile_sql = "SELECT `user`, `nickname` FROM `profile_profile` WHERE `user` IN %s"
-        cursor.execute(profile_sql, args=(user_list,))
-        users_profile = cursor.fetchall()
-        for user_profile in users_profile:
-            if user_profile.get('nickname'):
-                email_nike_map[user_profile.get('user')] = user_profile.get('nickname')
-            else:
-                email_nike_map[user_profile.get('user')] = user_profile.get('user').split('@')[0]
+        last_id = rows[-1]['id']
+
         for row in rows:
-            row['creator'] = email_nike_map.get(row['creator'])
+            profile_user = row.pop('profile_user')
+            nickname = row.pop('nickname')
+            if nickname:
+                row['creator'] = nickname
+            else:
+                row['creator'] = profile_user.split('@')[0] if profile_user else None
 
-        time.sleep(0.5)
-        mysql_rows += rows
+        yield rows
         if len(rows) < step:
             break
-        i += 1
 
+
+def get_watermark(conn, margin):
+    """The MySQL time `margin` seconds before now, taken before the dtables
+    are read: rows committed while the run reads, or by transactions that
+    started up to `margin` seconds earlier, are read again by the next run
+    """
+    cursor = conn.cursor(cursor=pymysql.cursors.DictCursor)
+    try:
+        cursor.execute("SELECT NOW() AS now")
+        now = cursor.fetchall()[0]['now']
+    finally:
+        cursor.close()
+    now = datetime.strptime(str(now)[:19], '%Y-%m-%d %H:%M:%S')
+    return str(now - timedelta(seconds=margin))
+
+
+def iter_incremental(conn, checkpoint, progress, step=1000, margin=300, overlap=1000):
+    """Yield the dtables created after the checkpoint, then the older ones
+    updated since it, e.g. renamed or deleted. `progress` collects the
+    checkpoint to store once every yielded page has been synced.
+
+    The last `overlap` ids before the checkpoint are read again, for rows
+    whose id was given out before the last run but that were committed after
+    it; the rows that did not change are skipped by the uuid index.
+    """
+    progress['updated_at'] = get_watermark(conn, margin)
+    if not checkpoint:
+        pages = iter_dtables(conn, step=step)
+    else:
+        start_id = max(checkpoint['last_id'] - overlap, 0)
+        pages = itertools.chain(
+            iter_dtables(conn, start_id=start_id, step=step),
+            iter_dtables(conn, where="d.id <= %s AND d.updated_at >= %s",
+                         args=(start_id, checkpoint['updated_at']), step=step))
+    for rows in pages:
+        progress['last_id'] = max(progress['last_id'], rows[-1]['id'])
+        yield rows
+
+
+def filter_synced(base, table_name, rows, scheduler):
+    """Drop the rows whose uuid is already in the table
+    """
     step = 100
     dtable_base_rows = {}
-    for i in range(0, len(mysql_rows), step):
-        query_str = ', '.join([f"'{row['uuid']}'" for row in mysql_rows[i: i + step]])
+    for i in range(0, len(rows), step):
+        query_str = ', '.join([f"'{row['uuid']}'" for row in rows[i: i + step]])
         query_sql = f"select uuid from `{table_name}` where uuid in ({query_str})"
-        id_rows = fixed_sql_query(base, query_sql)
+        with metrics.timed('dedup_query'):
+            id_rows = scheduler.call(fixed_sql_query, base, query_sql)
         dtable_base_rows.update({row['uuid']: True for row in id_rows})
-    mysql_rows = [get_row(row) for row in mysql_rows if not dtable_base_rows.get(row['uuid'])]
+    return [get_row(row) for row in rows if not dtable_base_rows.get(row['uuid'])]
+
+
+def resolve_row_ids(base, table_name, uuids, scheduler):
+    """Look up the row ids of `uuids` in the table
+    """
+    step = 100
+    row_ids = {}
+    for i in range(0, len(uuids), step):
+        query_str = ', '.join([f"'{uuid}'" for uuid in uuids[i: i + step]])
+        query_sql = f"select _id, uuid from `{table_name}` where uuid in ({query_str})"
+        with metrics.timed('dedup_query'):
+            id_rows = scheduler.call(fixed_sql_query, base, query_sql)
+        row_ids.update({row['uuid']: row['_id'] for row in id_rows})
+    return row_ids
+
 
-    return mysql_rows
+def update_rows(base, table_name, rows, index, scheduler, step=1000):
+    """Overwrite the synced rows with their current dtables values
+    """
+    row_ids = {uuid: row_id for uuid, (row_id, _) in index.lookup(row['uuid'] for row in rows).items()}
+    unknown = [uuid for uuid, row_id in row_ids.items() if not row_id]
+    if unknown:
+        resolved = resolve_row_ids(base, table_name, unknown, scheduler)
+        index.add([{'uuid': uuid, 'row_id': row_id} for uuid, row_id in resolved.items()])
+        row_ids.update(resolved)
+    updates = [{'row_id': row_ids[row['uuid']], 'row': row} for row in rows if row_ids.get(row['uuid'])]
+    for i in range(0, len(updates), step):
+        with metrics.timed('update'):
+            scheduler.call(base.batch_update_rows, table_name, updates[i: i + step])
+        metrics.ROWS.inc(len(updates[i: i + step]), table=table_name, op='update')
+        metrics.BATCH_ROWS.observe(len(updates[i: i + step]), table=table_name, op='update')
+        index.add([{'uuid': update['row']['uuid'], 'hash': get_row_hash(update['row'])}
+                   for update in updates[i: i + step]])
+    return len(updates)
+
+
+def append_rows(base, table_name, rows, index, scheduler):
+    """Append `rows` and return how many were appended. The scheduler does
+    not retry an append: when the error may have come after the rows were
+    written, the uuids are looked up in the table and only the missing rows
+    are sent again.
+    """
+    attempt = written_before = 0
+    while True:
+        try:
+            with metrics.timed('insert'):
+                result = scheduler.call(base.batch_append_rows, table_name, rows, idempotent=False)
+            break
+        except Exception as e:
+            attempt += 1
+            if not is_retryable(e) or attempt > scheduler.max_retries:
+                raise
+            logger.warning('append %s rows error: %s, check which were written', len(rows), e)
+            time.sleep(backoff(attempt))
+            written = resolve_row_ids(base, table_name, [row['uuid'] for row in rows], scheduler)
+            if index is not None and written:
+                index.add([{'uuid': row['uuid'], 'row_id': written[row['uuid']], 'hash': get_row_hash(row)}
+                           for row in rows if row['uuid'] in written])
+            written_before += len(written)
+            rows = [row for row in rows if row['uuid'] not in written]
+            if not rows:
+                return written_before
+    metrics.ROWS.inc(len(rows), table=table_name, op='append')
+    metrics.BATCH_ROWS.observe(len(rows), table=table_name, op='append')
+    if index is not None:
+        index.add(get_row_ids(result, rows))
+    return written_before + len(rows)
+
+
+def get_row_ids(result, rows):
+    """Pair the appended rows with the row ids returned by batch_append_rows
+    """
+    row_ids = (result or {}).get('row_ids') or []
+    if len(row_ids) != len(rows):
+        return [{'uuid': row['uuid'], 'hash': get_row_hash(row)} for row in rows]
+    return [{'uuid': row['uuid'], 'row_id': row_id.get('_id'), 'hash': get_row_hash(row)}
+            for row, row_id in zip(rows, row_ids)]
+
+
+def normalize(value):
+    """The same value whether it was read from MySQL or back from the table:
+    empty and false values as None, numbers as floats and times to the minute
+    """
+    if value in (None, '', False):
+        return None
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    value = str(value)
+    if TIME_VALUE.match(value):
+        return value[:16].replace('T', ' ')
+    return value
+
+
+def get_row_hash(row):
+    """Hash the synced columns of a row, to tell whether it changed since it was synced
+    """
+    row = {column: normalize(row.get(column)) for column in SYNCED_COLUMNS}
+    return hashlib.sha1(json.dumps(row, sort_keys=True).encode('utf-8')).hexdigest()
 
 
 def get_row(row):
+    row.pop('id', None)
+    row.pop('updated_at', None)
     row['created_at'] = str(row.get('created_at'))
     return row
 
@@ -74,23 +245,105 @@ def fixed_sql_query(seatable, sql):
         return []
 
 
-def sync(mode, table_name, username, password, db_name, host, charset, api_token, dtable_web_service_url, date=None):
+def open_index(base, table_name, index_path, scheduler, reconcile=False):
+    """Open the uuid index, bootstrapping it from the table when it is new,
+    was built for another table or a reconcile is requested
+    """
+    index = UuidIndex(index_path)
+    if reconcile or not index.is_bootstrapped(table_name):
+        index.bootstrap(base, table_name, lambda base, sql: scheduler.call(fixed_sql_query, base, sql),
+                        columns=SYNCED_COLUMNS, get_hash=get_row_hash)
+    return index
+
+
+def sync_pages(base, table_name, source, scheduler, index=None, update_unhashed=False, queue_size=8, workers=4):
+    """Run the pages of `source` through the diff and write stages and
+    return the number of appended and updated rows
+    """
+    lock = threading.Lock()
+    counts = {'append': 0, 'update': 0}
+
+    def diff(rows):
+        if index is None:
+            rows = filter_synced(base, table_name, rows, scheduler)
+            return {'append': rows, 'update': []} if rows else None
+        with metrics.timed('index_lookup'):
+            synced = index.lookup(row['uuid'] for row in rows)
+        page = {'append': [], 'update': []}
+        unhashed = []
+        for row in rows:
+            row = get_row(row)
+            if row['uuid'] not in synced:
+                page['append'].append(row)
+                continue
+            row_hash = synced[row['uuid']][1]
+            if row_hash is None and not update_unhashed:
+                unhashed.append({'uuid': row['uuid'], 'hash': get_row_hash(row)})
+            elif row_hash != get_row_hash(row):
+                page['update'].append(row)
+        if unhashed:
+            index.add(unhashed)
+        return page if page['append'] or page['update'] else None
+
+    def write(page):
+        step = 1000
+        rows = page['append']
+        appended = 0
+        for i in range(0, len(rows), step):
+            appended += append_rows(base, table_name, rows[i: i + step], index, scheduler)
+        updated = update_rows(base, table_name, page['update'], index, scheduler) if page['update'] else 0
+        with lock:
+            counts['append'] += appended
+            counts['update'] += updated
+
+    pipeline = Pipeline(queue_size=queue_size)
+    pipeline.add_stage(diff, workers=workers)
+    pipeline.add_stage(write, workers=workers)
+    try:
+        pipeline.run(source)
+    finally:
+        logger.info('sync %s new bases, update %s bases', counts['append'], counts['update'])
+    return counts
+
+
+def sync(mode, table_name, username, password, db_name, host, charset, api_token, dtable_web_service_url, date=None,
+         max_in_flight=4, queue_size=8, index_path=None, reconcile=False, requests_per_second=0,
+         incremental_margin=300, incremental_overlap=1000):
     conn = pymysql.connect(user=username, password=password, database=db_name, host=host, charset=charset)
-    cursor = conn.cursor(cursor=pymysql.cursors.DictCursor)
     logger.info('connect mysql successfully!')
 
     base = Base(api_token, dtable_web_service_url)
     base.auth()
     logger.info('api_token: %s, dtable_web_service_url: %s auth successfully!', api_token, dtable_web_service_url)
 
-    mysql_rows = get_dtables(base, mode, cursor, table_name, date=date)
-    logger.info(f'fetch {len(mysql_rows)} bases')
-    step = 1000
-    for i in range(0, len(mysql_rows), step):
-        base.batch_append_rows(table_name, mysql_rows[i: i + step])
+    # mysql fetch, diff and write run concurrently; the scheduler caps the
+    # SeaTable requests of both seatable stages together
+    scheduler = RequestScheduler(rate=requests_per_second, max_in_flight=max_in_flight)
 
-    conn.close()
-    cursor.close()
+    # with an index, dedup and change detection are local lookups and the base
+    # is only scanned once to bootstrap it, or again when a reconcile is requested
+    index = None
+    if index_path:
+        index = open_index(base, table_name, index_path, scheduler, reconcile=reconcile)
+
+    try:
+        if mode == 'INCREMENTAL':
+            checkpoint = index.get_checkpoint(table_name)
+            progress = dict(checkpoint or {'last_id': 0, 'updated_at': None})
+            # rows synced before their hash was recorded are only known to have
+            # changed when an incremental run after a checkpoint sees them
+            pages = iter_incremental(conn, checkpoint, progress, margin=incremental_margin, overlap=incremental_overlap)
+            sync_pages(base, table_name, pages, scheduler, index=index,
+                       update_unhashed=bool(checkpoint), queue_size=queue_size, workers=max_in_flight)
+            index.set_checkpoint(table_name, progress)
+        else:
+            where, args = get_dtables_filter(mode, date)
+            sync_pages(base, table_name, iter_dtables(conn, where=where, args=args), scheduler, index=index,
+                       queue_size=queue_size, workers=max_in_flight)
+    finally:
+        conn.close()
+        if index is not None:
+            index.close()
 
 
 def main():
@@ -104,7 +357,12 @@ def main():
         except Exception as e:
             logger.error('date: %s invalid, should be %%Y-%%m-%%d', settings.DATE)
             return
+    elif settings.MODE == 'INCREMENTAL' and not settings.UUID_INDEX_PATH:
+        logger.error('INCREMENTAL mode keeps its checkpoint in the uuid index, UUID_INDEX_PATH is required')
+        return
 
+    if settings.METRICS_PORT:
+        metrics.serve(settings.METRICS_PORT)
     try:
         sync(
             mode=settings.MODE,
@@ -116,7 +374,14 @@ def main():
             charset=settings.CHARSET,
             api_token=settings.BASE_API_TOKEN,
             dtable_web_service_url=settings.DTABLE_WEB_SERVICE_URL,
-            date=date)
+            date=date,
+            max_in_flight=settings.MAX_IN_FLIGHT_REQUESTS,
+            queue_size=settings.PIPELINE_QUEUE_SIZE,
+            index_path=settings.UUID_INDEX_PATH,
+            reconcile=settings.RECONCILE,
+            requests_per_second=settings.REQUESTS_PER_SECOND,
+            incremental_margin=settings.INCREMENTAL_MARGIN,
+            incremental_overlap=settings.INCREMENTAL_OVERLAP)
     except Exception as e:
         logger.exception(e)
         logger.error('sync base error: %s', e)
@@ -0,0 +1,77 @@
+import queue
+import logging
+import threading
+
+from sync_common import metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Pipeline(object):
+    """Run a chain of stages on worker threads, connected by bounded queues.
+
+    Every stage takes one item and returns the item for the next stage, or
+    None to drop it. A full queue blocks the stage in front of it, so a slow
+    stage holds back the faster ones instead of piling up items in memory.
+    """
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+        self.error = None
+        self.stopped = threading.Event()
+
+    def add_stage(self, func, workers=1):
+        self.stages.append((func, workers))
+        return self
+
+    def _work(self, func, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            metrics.QUEUE_DEPTH.set(in_queue.qsize(), queue=func.__name__)
+            if item is _DONE:
+                break
+            if self.stopped.is_set():
+                # keep draining so that upstream never blocks on a full queue
+                continue
+            try:
+                result = func(item)
+            except Exception as e:
+                logger.exception(e)
+                self.error = self.error or e
+                self.stopped.set()
+                continue
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+    def run(self, source):
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        stage_threads = []
+        for index, (func, workers) in enumerate(self.stages):
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+            threads = [threading.Thread(target=self._work, args=(func, queues[index], out_queue), daemon=True)
+                       for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        try:
+            for item in source:
+                if self.stopped.is_set():
+                    break
+                queues[0].put(item)
+        except Exception as e:
+            self.error = self.error or e
+            self.stopped.set()
+        finally:
+            # shut the stages down front to back so every item is flushed
+            for index, threads in enumerate(stage_threads):
+                for _ in threads:
+                    queues[index].put(_DONE)
+                for thread in threads:
+                    thread.join()
+
+        if self.error:
+            raise self.error
@@ -11,8 +11,29 @@ DB_NAME = ''
 CHARSET = 'utf8'
 BASE_TABLE_NAME = ''
 
-MODE = ''  # ALL or ON
+MODE = ''  # ALL, ON or INCREMENTAL (only the dtables created or updated since the last run)
 DATE = ''  # only for ON mode, if empty or None default today
+# INCREMENTAL mode: the dtables updated up to INCREMENTAL_MARGIN seconds before
+# the last run started, and the last INCREMENTAL_OVERLAP ids, are read again
+INCREMENTAL_MARGIN = 300
+INCREMENTAL_OVERLAP = 1000
+
+# pipeline
+MAX_IN_FLIGHT_REQUESTS = 4  # concurrent requests to SeaTable
+PIPELINE_QUEUE_SIZE = 8  # pages buffered between stages
+# requests per second to SeaTable, 0 for no limit: throttled requests are
+# retried after the server's Retry-After, failing ones with a jittered backoff
+REQUESTS_PER_SECOND = 0
+
+# local index of the uuids already synced, empty to dedup against the base
+UUID_INDEX_PATH = 'base_syncer_index.db'
+RECONCILE = False  # rebuild the index from the base before syncing, rows changed in the base are updated again
+
+# metrics: Prometheus text format on http://<host>:<METRICS_PORT>/metrics while a sync runs, 0 to not serve them
+METRICS_PORT = 0
+
+# backfill.py
+BACKFILL_WORKERS = 4  # shards synced concurrently
 
 
 import os
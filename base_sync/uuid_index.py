@@ -0,0 +1,106 @@
+import json
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UuidIndex(object):
+    """Local SQLite record of the dtables uuids already in the target table
+    and the hash of their synced values, so that dedup and change detection
+    are local lookups instead of queries to dtable-server.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS uuids (uuid TEXT PRIMARY KEY, row_id TEXT, hash TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # indexes created before the hash column was added
+            columns = [column[1] for column in self.conn.execute("PRAGMA table_info(uuids)")]
+            if 'hash' not in columns:
+                self.conn.execute("ALTER TABLE uuids ADD COLUMN hash TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def _get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def is_bootstrapped(self, table_name):
+        return self._get_meta('table_name') == table_name
+
+    def bootstrap(self, base, table_name, query, columns=(), get_hash=None, step=10000):
+        """Rebuild the index from a full scan of the table.
+
+        `query` runs one SQL query against the base, e.g. through the scheduler.
+        With `get_hash` the hash of the `columns` as they are in the table is
+        recorded too, so rows that were changed in the table are updated again.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM uuids")
+            self.conn.execute("DELETE FROM meta WHERE key = 'table_name'")
+        select = ', '.join(['_id', 'uuid'] + [column for column in columns if column not in ('_id', 'uuid')])
+        offset = 0
+        while True:
+            sql = f"select {select} from `{table_name}` order by _id limit {step} offset {offset}"
+            rows = query(base, sql)
+            self.add([{
+                'uuid': row['uuid'],
+                'row_id': row['_id'],
+                'hash': get_hash({column: row.get(column) for column in columns}) if get_hash else None,
+            } for row in rows if row.get('uuid')])
+            if len(rows) < step:
+                break
+            offset += step
+        self._set_meta('table_name', table_name)
+        logger.info('uuid index bootstrapped with %s uuids from %s', self.count(), table_name)
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM uuids").fetchone()[0]
+
+    def lookup(self, uuids):
+        """Return {uuid: (row_id, hash)} for the `uuids` in the index, the
+        row id or hash is None when it is not known yet
+        """
+        uuids = list(uuids)
+        found = {}
+        step = 500
+        with self.lock:
+            for i in range(0, len(uuids), step):
+                chunk = uuids[i: i + step]
+                sql = "SELECT uuid, row_id, hash FROM uuids WHERE uuid IN (%s)" % ','.join('?' * len(chunk))
+                found.update((row[0], (row[1], row[2])) for row in self.conn.execute(sql, chunk))
+        return found
+
+    def get_checkpoint(self, table_name):
+        value = self._get_meta('checkpoint:' + table_name)
+        return json.loads(value) if value else None
+
+    def set_checkpoint(self, table_name, checkpoint):
+        self._set_meta('checkpoint:' + table_name, json.dumps(checkpoint))
+
+    def is_shard_synced(self, table_name, shard):
+        return self._get_meta('shard:%s:%s' % (table_name, shard)) is not None
+
+    def set_shard_synced(self, table_name, shard):
+        self._set_meta('shard:%s:%s' % (table_name, shard), 'done')
+
+    def add(self, items):
+        """Record `items`, dicts with `uuid` and optional `row_id` and `hash`
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO uuids (uuid, row_id, hash) VALUES (?, ?, ?) "
+                "ON CONFLICT(uuid) DO UPDATE SET row_id = COALESCE(excluded.row_id, uuids.row_id), "
+                "hash = COALESCE(excluded.hash, uuids.hash)",
+                [(item['uuid'], item.get('row_id'), item.get('hash')) for item in items])
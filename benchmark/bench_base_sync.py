@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Measure the base_sync pipeline against the SQLite dtables stand-in and the
+in-process SeaTable fake.
+
+usage: python3 bench_base_sync.py --rows 10000 [--db dtables.db] [--latency 0.05] [--error-rate 0.01]
+
+Three runs are timed: the initial sync into an empty table, a rerun with no
+changes, and a rerun after --changes of the dtables were renamed.
+"""
+import argparse
+import tempfile
+import os
+
+from common import Timer, add_path, report
+from fake_mysql import connect, seed
+from fake_seatable import FakeBase
+
+add_path('base_sync')
+
+from base_syncer import iter_dtables, open_index, sync_pages  # noqa: E402
+from sync_common.scheduler import RequestScheduler  # noqa: E402
+
+TABLE_NAME = 'Bases'
+
+
+def run(name, base, conn, index, scheduler, args):
+    base.requests.clear()
+    base.errors.clear()
+    with Timer() as timer:
+        sync_pages(base, TABLE_NAME, iter_dtables(conn), scheduler, index=index,
+                   queue_size=args.queue_size, workers=args.max_in_flight)
+    report(name, args.rows, timer.elapsed, base.requests, base.errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000, help='e.g. 10000, 1000000 or 10000000')
+    parser.add_argument('--db', default=':memory:', help='sqlite file to keep the seeded dtables between runs')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per SeaTable request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of SeaTable requests rejected')
+    parser.add_argument('--changes', type=float, default=0.01, help='share of dtables renamed before the last run')
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0, help='SeaTable requests per second, 0 for no limit')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    with Timer() as timer:
+        seed(conn, args.rows)
+    print('seeded %s dtables in %.2fs' % (args.rows, timer.elapsed))
+
+    base = FakeBase(latency=args.latency, error_rate=args.error_rate)
+    scheduler = RequestScheduler(rate=args.rate, max_in_flight=args.max_in_flight)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = open_index(base, TABLE_NAME, os.path.join(tmp, 'index.db'), scheduler)
+        run('initial sync', base, conn, index, scheduler, args)
+        run('rerun, no changes', base, conn, index, scheduler, args)
+
+        changed = int(args.rows * args.changes)
+        conn.conn.execute("UPDATE dtables SET name = name || ' renamed' WHERE id <= ?", (changed,))
+        run('rerun, %s changed' % changed, base, conn, index, scheduler, args)
+        index.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
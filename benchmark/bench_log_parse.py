@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the log time extraction of log_syncer, compared with the
+former four-regex chain that matched every pattern twice.
+
+usage: python3 bench_log_parse.py [--rows 200000]
+"""
+import re
+import json
+import argparse
+
+from common import Timer, add_path
+from log_corpus import generate_logs
+
+add_path('log-sync')
+
+from log_parser import TimestampParser  # noqa: E402
+
+DATETIME_MATCH_1 = r'^(\d{4}-\d{1,2}-\d{1,2}\s\d{1,2}:\d{1,2}:\d{1,2})'
+DATETIME_MATCH_2 = r'^(\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2})'
+DATETIME_MATCH_3 = r'^\[(\d{4}-\d{1,2}-\d{1,2}\s\d{1,2}:\d{1,2}:\d{1,2})'
+DATETIME_MATCH_4 = r'^\[(\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2})'
+
+
+def legacy_parse(msg):
+    if re.match(DATETIME_MATCH_1, msg):
+        return re.match(DATETIME_MATCH_1, msg).group(1)
+    elif re.match(DATETIME_MATCH_2, msg):
+        return re.match(DATETIME_MATCH_2, msg).group(1).replace('T', ' ')
+    elif re.match(DATETIME_MATCH_3, msg):
+        return re.match(DATETIME_MATCH_3, msg).group(1)
+    elif re.match(DATETIME_MATCH_4, msg):
+        return re.match(DATETIME_MATCH_4, msg).group(1).replace('T', ' ')
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    messages = [json.loads(log)['message'] for log in generate_logs(args.rows)]
+    timestamp_parser = TimestampParser()
+    extra_parser = TimestampParser(['syslog', 'nginx', 'epoch_millis'])
+
+    results = {}
+    for name, parse in [('four regexes', legacy_parse),
+                        ('TimestampParser', timestamp_parser.parse),
+                        ('+ syslog/nginx/epoch', extra_parser.parse)]:
+        with Timer() as timer:
+            results[name] = [parse(msg) for msg in messages]
+        print('%-24s %8.3fs %12.0f lines/s' % (name, timer.elapsed, len(messages) / timer.elapsed))
+    assert results['four regexes'] == results['TimestampParser']
+
+
+if __name__ == '__main__':
+    main()
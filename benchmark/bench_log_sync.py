@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Measure LogSyncer.send, log parsing plus the insert request, against the
+in-process SeaTable fake.
+
+usage: python3 bench_log_sync.py --rows 100000 [--batch 10] [--latency 0.05]
+"""
+import logging
+import argparse
+
+from common import Timer, add_path, report
+from fake_seatable import FakeBase
+from log_corpus import generate_logs
+
+add_path('log-sync')
+
+from log_syncer import LogSyncer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=10, help='logs per insert request')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per SeaTable request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of SeaTable requests rejected')
+    parser.add_argument('--log', action='store_true', help='keep the INFO logging of the syncer')
+    args = parser.parse_args()
+    if not args.log:
+        logging.disable(logging.INFO)
+
+    logs = generate_logs(args.rows)
+    base = FakeBase(latency=args.latency, error_rate=args.error_rate)
+    log_syncer = LogSyncer(base=base)
+    sent = 0
+    with Timer() as timer:
+        for i in range(0, len(logs), args.batch):
+            try:
+                log_syncer.send(logs[i: i + args.batch])
+                sent += len(logs[i: i + args.batch])
+            except ConnectionError:
+                pass
+    report('send', sent, timer.elapsed, base.requests, base.errors)
+
+
+if __name__ == '__main__':
+    main()
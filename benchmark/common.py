@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+import resource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_path(*parts):
+    sys.path.insert(0, os.path.join(ROOT, *parts))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Timer(object):
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def report(name, rows, elapsed, requests=None, errors=None):
+    print('%-24s %10d rows %8.2fs %12.0f rows/s  peak rss %8.1f MB' % (
+        name, rows, elapsed, rows / elapsed if elapsed else 0, peak_rss_mb()))
+    if requests:
+        print('%-24s requests: %s' % ('', ', '.join('%s=%s' % item for item in sorted(requests.items()))))
+    if errors:
+        print('%-24s errors: %s' % ('', ', '.join('%s=%s' % item for item in sorted(errors.items()))))
@@ -0,0 +1,97 @@
+"""
+SQLite stand-in for the pymysql connection used by base_sync, seeded with
+synthetic dtables and profile_profile rows.
+
+Only the SQL base_sync sends in the ALL and INCREMENTAL modes and in backfill
+shards is supported, with NOW(); the other MySQL date functions of the ON
+mode are not.
+"""
+import os
+import random
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def execute(self, sql, args=()):
+        # pymysql expands a list argument into "(a, b, ...)"
+        params = []
+        parts = sql.split('%s')
+        sql = parts[0]
+        for arg, part in zip(args, parts[1:]):
+            if isinstance(arg, (list, tuple)):
+                sql += '(%s)' % ','.join('?' * len(arg)) + part
+                params.extend(arg)
+            else:
+                sql += '?' + part
+                params.append(arg)
+        self.cursor.execute(sql, params)
+
+    def fetchall(self):
+        columns = [column[0] for column in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def close(self):
+        self.cursor.close()
+
+
+class FakeConnection(object):
+
+    def __init__(self, path=':memory:'):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.create_function('NOW', 0, lambda: str(datetime.now().replace(microsecond=0)))
+
+    def cursor(self, cursor=None):
+        return FakeCursor(self.conn)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+def seed(conn, rows, users=1000, start=datetime(2021, 1, 1)):
+    """Fill dtables with `rows` bases created by `users` users, one every
+    few seconds from `start`. Seeding is skipped when the table already
+    holds that many rows, so a file database can be reused between runs.
+    """
+    db = conn.conn
+    db.execute("CREATE TABLE IF NOT EXISTS dtables (id INTEGER PRIMARY KEY, uuid TEXT, name TEXT, creator TEXT, "
+               "created_at TEXT, updated_at TEXT, workspace_id INTEGER, deleted INTEGER)")
+    db.execute("CREATE TABLE IF NOT EXISTS profile_profile (id INTEGER PRIMARY KEY, user TEXT UNIQUE, nickname TEXT)")
+    db.execute("CREATE INDEX IF NOT EXISTS dtables_created_at ON dtables (created_at)")
+    if db.execute("SELECT COUNT(*) FROM dtables").fetchone()[0] == rows:
+        return
+
+    db.execute("DELETE FROM dtables")
+    db.execute("DELETE FROM profile_profile")
+    emails = ['user%s@example.com' % i for i in range(users)]
+    db.executemany("INSERT INTO profile_profile (user, nickname) VALUES (?, ?)",
+                   [(email, 'User %s' % i if i % 3 else '') for i, email in enumerate(emails)])
+    step = 100000
+    for i in range(0, rows, step):
+        batch = []
+        for n in range(i, min(i + step, rows)):
+            created_at = str(start + timedelta(seconds=n * 5))
+            batch.append((n + 1, str(uuid.uuid4()), 'base %s' % n, random.choice(emails),
+                          created_at, created_at, n % 100, 0))
+        db.executemany("INSERT INTO dtables VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    db.commit()
+
+
+def connect(path=':memory:'):
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return FakeConnection(path)
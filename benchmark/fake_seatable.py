@@ -0,0 +1,107 @@
+"""
+In-process stand-in for the seatable_api.Base methods used by the syncers,
+with configurable latency and error injection.
+"""
+import re
+import time
+import random
+import string
+import threading
+from collections import Counter
+
+UUID_IN = re.compile(r"select (?P<columns>[\w, ]+) from `(?P<table>[^`]+)` where uuid in \((?P<uuids>.*)\)$", re.I)
+SCAN = re.compile(r"select (?P<columns>[\w, ]+) from `(?P<table>[^`]+)` order by _id limit (?P<limit>\d+) offset (?P<offset>\d+)$", re.I)
+
+
+def random_id(length=22):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+class FakeTable(object):
+
+    def __init__(self):
+        self.rows = {}
+        self.uuids = {}
+
+    def append(self, row):
+        row = dict(row, _id=random_id())
+        self.rows[row['_id']] = row
+        if row.get('uuid'):
+            self.uuids[row['uuid']] = row
+        return row['_id']
+
+
+class FakeBase(object):
+    """Keep the tables in memory and answer the SQL the syncers send.
+
+    `latency` seconds are spent in every request; `error_rate` is the share
+    of requests rejected with ConnectionError(429), like seatable_api does
+    for a throttled request.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tables = {}
+        self.requests = Counter()
+        self.errors = Counter()
+        self.lock = threading.Lock()
+
+    def _request(self, name):
+        with self.lock:
+            self.requests[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors[name] += 1
+            raise ConnectionError(429, '{"error_msg": "Too many requests"}')
+
+    def _table(self, table_name):
+        with self.lock:
+            return self.tables.setdefault(table_name, FakeTable())
+
+    def auth(self):
+        self._request('auth')
+
+    def query(self, sql):
+        self._request('query')
+        sql = sql.strip()
+        match = UUID_IN.match(sql)
+        if match:
+            table = self._table(match.group('table'))
+            uuids = re.findall(r"'([^']*)'", match.group('uuids'))
+            rows = [table.uuids[uuid] for uuid in uuids if uuid in table.uuids]
+        else:
+            match = SCAN.match(sql)
+            if not match:
+                raise ValueError('unsupported sql: %s' % sql)
+            table = self._table(match.group('table'))
+            offset, limit = int(match.group('offset')), int(match.group('limit'))
+            with self.lock:
+                rows = [table.rows[row_id] for row_id in sorted(table.rows)[offset: offset + limit]]
+        columns = [column.strip() for column in match.group('columns').split(',')]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    def batch_append_rows(self, table_name, rows_data):
+        self._request('batch_append_rows')
+        table = self._table(table_name)
+        with self.lock:
+            row_ids = [{'_id': table.append(row)} for row in rows_data]
+        return {'inserted_row_count': len(rows_data), 'row_ids': row_ids}
+
+    def batch_update_rows(self, table_name, rows_data):
+        self._request('batch_update_rows')
+        table = self._table(table_name)
+        with self.lock:
+            for update in rows_data:
+                table.rows[update['row_id']].update(update['row'])
+        return {'success': True}
+
+    def big_data_insert_rows(self, table_name, rows_data):
+        self._request('big_data_insert_rows')
+        table = self._table(table_name)
+        with self.lock:
+            for row in rows_data:
+                table.append(row)
+        return {'inserted_row_count': len(rows_data)}
@@ -0,0 +1,25 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+SERVICES = ['dtable-web', 'dtable-server', 'dtable-events']
+FORMATS = [
+    '{time:%Y-%m-%d %H:%M:%S},123 [ERROR] django.request:228 log_response Internal Server Error: /api/v2.1/dtables/',
+    '{time:%Y-%m-%dT%H:%M:%S}.123Z [ERROR] dtable-server: Failed to save dtable 6c5a 01a2 to storage',
+    '[{time:%Y-%m-%d %H:%M:%S}] [ERROR] dtable_events.tasks:55 run Failed to handle message',
+    '[{time:%Y-%m-%dT%H:%M:%S}] [ERROR] seaf-server: repo-mgr.c(1024): Failed to get head commit',
+    'Traceback (most recent call last):\n  File "views.py", line 12, in get\nKeyError: \'workspace\'',
+]
+
+
+def generate_logs(count, start=datetime(2021, 6, 1), seed=0):
+    """Filebeat entries as they are pushed to redis, in the formats of the SeaTable logs
+    """
+    rand = random.Random(seed)
+    logs = []
+    for i in range(count):
+        message = rand.choice(FORMATS).format(time=start + timedelta(seconds=i))
+        if rand.random() < 0.3:
+            message += '\nTraceback (most recent call last):\n  File "x.py", line 1, in <module>\nValueError: %s' % i
+        logs.append(json.dumps({'message': message, 'tags': [rand.choice(SERVICES)]}).encode('utf-8'))
+    return logs
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+asyncio variant of log_syncer: aiohttp, with a pooled keep-alive connection,
+for the dtable-db insert requests. Up to async_max_in_flight inserts run while
+the next batch is read. The redis side, LogQueue and the shared rate limit,
+is the one of log_syncer, run on a thread pool of the syncer with a thread
+per insert in flight, one to read the next batch and one for the heartbeat.
+
+usage: python3 async_log_syncer.py
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_common import metrics
+from sync_common.scheduler import RequestScheduler, backoff, get_status
+
+from log_aggregator import aggregate
+from log_parser import TimestampParser
+from log_queue import LogQueue
+from log_syncer import get_rows, get_lag
+from rate_limiter import get_server_limiter
+from settings import server_url, api_token, table_name, filebeat_key, \
+    redis_host, redis_port, redis_db, redis_password, log_time_formats, \
+    reliable_delivery, worker_id, max_delivery_attempts, max_requests_per_second, async_max_in_flight, shards, \
+    aggregate_window, aggregate_max_keys, metrics_port, metrics_interval, circuit_failure_threshold, \
+    circuit_reset_timeout, heartbeat_timeout
+
+
+class AsyncLogSyncer(object):
+    """Same redis layout as LogSyncer, with one processing list per in-flight
+    batch ('<processing key>/<slot>') so that batches are acknowledged one by one.
+    """
+
+    def __init__(self, r=None, key=filebeat_key, table=table_name, server=server_url, token=api_token,
+                 worker_name=None, max_in_flight=async_max_in_flight):
+        self.r = r or redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password)
+        self.server_url = server
+        self.api_token = token
+        self.key = key
+        self.table_name = table
+        self.timestamp_parser = TimestampParser(log_time_formats)
+        self.max_in_flight = max_in_flight
+        self.reliable = reliable_delivery
+        self.worker_id = worker_name or worker_id or socket.gethostname()
+        self.queue = LogQueue(self.r, self.key, self.worker_id, reliable=self.reliable)
+        self.limiter = get_server_limiter(self.r, server, max_requests_per_second)
+        # the blocking redis calls, a BLMOVE holds its thread for up to
+        # idle_timeout, so the syncer does not share the default executor
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight + 2,
+                                           thread_name_prefix='%s-redis' % self.worker_id)
+        # only the retry delays and the circuit breaker of the scheduler are
+        # used, the requests are sent by aiohttp
+        self.scheduler = RequestScheduler(max_in_flight=max_in_flight, failure_threshold=circuit_failure_threshold,
+                                          reset_timeout=circuit_reset_timeout)
+        self.free_slots = asyncio.Queue()
+        for slot in range(max_in_flight):
+            self.free_slots.put_nowait(slot)
+        self.session = None
+        self.insert_url = None
+        self.headers = None
+        self.last_report = 0
+
+    def slot_key(self, slot):
+        return '%s/%s' % (self.queue.processing_key, slot)
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def auth(self):
+        url = self.server_url.rstrip('/') + '/api/v2.1/dtable/app-access-token/'
+        async with self.session.get(url, headers={'Authorization': 'Token ' + self.api_token}) as response:
+            response.raise_for_status()
+            data = await response.json()
+        if data.get('use_api_gateway'):
+            # like seatable_api, servers with the api gateway take the inserts there
+            self.insert_url = '%s/api-gateway/api/v2/dtables/%s/add-archived-rows/' % (
+                self.server_url.rstrip('/'), data['dtable_uuid'])
+        elif data.get('dtable_db'):
+            self.insert_url = '%s/api/v1/insert-rows/%s/' % (data['dtable_db'].rstrip('/'), data['dtable_uuid'])
+        else:
+            raise ValueError('%s returned neither dtable_db nor use_api_gateway, cannot insert rows'
+                             % self.server_url)
+        self.headers = {'Authorization': 'Token ' + data['access_token']}
+
+    async def wait_for_server(self):
+        """Wait while the server asked to hold back requests or the circuit is open
+        """
+        while True:
+            paused = self.scheduler.bucket.paused_for()
+            if paused:
+                await asyncio.sleep(paused)
+            elif self.scheduler.breaker.allow():
+                return
+            else:
+                await asyncio.sleep(1)
+
+    async def insert(self, rows):
+        await self.call(self.limiter.acquire)
+        json_data = {'table_name': self.table_name, 'rows': rows}
+        with metrics.timed('insert'):
+            async with self.session.post(self.insert_url, json=json_data, headers=self.headers) as response:
+                if response.status in (401, 403):
+                    await self.auth()
+                response.raise_for_status()
+        metrics.ROWS.inc(len(rows), table=self.table_name)
+        metrics.BATCH_ROWS.observe(len(rows), table=self.table_name)
+
+    async def report(self):
+        if time.time() - self.last_report < metrics_interval:
+            return
+        self.last_report = time.time()
+        metrics.QUEUE_DEPTH.set(await self.call(self.queue.count), queue=self.key)
+
+    async def keep_alive(self):
+        """Heartbeat and reap on their own: while SeaTable is unavailable all
+        slots retry their batch, and the worker must not look stopped to the
+        others, who would re-queue the batches in flight
+        """
+        while True:
+            try:
+                await self.call(self.queue.heartbeat)
+                await self.call(self.queue.reap)
+            except redis.exceptions.ConnectionError as e:
+                logging.warning('redis error: %s', e)
+                metrics.RETRIES.inc(reason='redis', queue=self.key)
+            await asyncio.sleep(heartbeat_timeout / 4)
+
+    async def deliver(self, slot, logs):
+        """Insert one batch, retrying with backoff; the slot is released once
+        the batch is inserted or, after max_delivery_attempts rejections,
+        moved to the dead list
+        """
+        slot_key = self.slot_key(slot)
+        try:
+            rows = get_rows(logs, self.timestamp_parser)
+            if aggregate_window:
+                # batches are acknowledged one by one, so logs are only
+                # aggregated within their batch
+                rows = aggregate(rows, aggregate_max_keys)
+            inserted = False
+            # failures in a row, and the ones where SeaTable answered and
+            # rejected the rows; only rejections count toward max_delivery_attempts
+            attempt = rejected = 0
+            while True:
+                await self.wait_for_server()
+                try:
+                    if rows:
+                        await self.insert(rows)
+                    self.scheduler.breaker.success()
+                    inserted = True
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    attempt += 1
+                    logging.warning('insert %s rows failed (attempt %s): %s', len(rows), attempt, e)
+                    metrics.RETRIES.inc(reason='insert', queue=self.key)
+                    # network errors have no status, the token is renewed by insert() on 401 and 403
+                    if get_status(e) in (None, 401, 403):
+                        delay = backoff(attempt)
+                    else:
+                        delay = self.scheduler.retry_delay(e, attempt)
+                    if delay is None:
+                        # the server is up and rejected the rows
+                        self.scheduler.breaker.success()
+                        rejected += 1
+                        if rejected >= max_delivery_attempts:
+                            break
+                        delay = backoff(rejected)
+                    elif get_status(e) != 429:
+                        # SeaTable is unavailable, retried until it is back
+                        self.scheduler.breaker.failure()
+                    await asyncio.sleep(delay)
+            if inserted:
+                lag = get_lag(logs[-1])
+                if lag is not None:
+                    metrics.LAG.set(lag, queue=self.key)
+            else:
+                logging.error('move %s logs to %s after %s rejected attempts', len(logs), self.queue.dead_key, rejected)
+                if self.reliable:
+                    await self.call(self.queue.move_to_dead, logs, slot_key)
+            await self.call(self.queue.ack, slot_key)
+        except Exception as e:
+            # the logs stay in the slot list and are retried when the slot is used next
+            logging.exception(e)
+        finally:
+            self.free_slots.put_nowait(slot)
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(total=60)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as self.session:
+            await self.auth()
+            logging.info('%s logs count: %s', self.key, await self.call(self.queue.count))
+            tasks = set()
+            errors = 0
+            tasks.add(asyncio.ensure_future(self.keep_alive()))
+            while True:
+                slot = await self.free_slots.get()
+                try:
+                    await self.report()
+                    # logs left in the slot by a previous run are retried first
+                    logs = await self.call(self.queue.pending, self.slot_key(slot))
+                    logs = logs or await self.call(self.queue.next_batch, self.slot_key(slot))
+                except redis.exceptions.ConnectionError as e:
+                    logging.exception('redis error: %s', e)
+                    metrics.RETRIES.inc(reason='redis', queue=self.key)
+                    self.free_slots.put_nowait(slot)
+                    errors += 1
+                    await asyncio.sleep(backoff(errors, base_delay=1, max_delay=60))
+                    continue
+                errors = 0
+                if not logs:
+                    self.free_slots.put_nowait(slot)
+                    continue
+                task = asyncio.ensure_future(self.deliver(slot, logs))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+
+async def run_shards(shard_list):
+    """`workers` AsyncLogSyncers per shard, see log_syncer.run_workers
+    """
+    r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password)
+    hostname = worker_id or socket.gethostname()
+    syncers = []
+    for shard in shard_list:
+        workers = shard.get('workers', 1)
+        for n in range(workers):
+            syncers.append(AsyncLogSyncer(
+                r=r,
+                key=shard['key'],
+                table=shard.get('table_name', table_name),
+                server=shard.get('server_url', server_url),
+                token=shard.get('api_token', api_token),
+                worker_name=hostname if workers == 1 else '%s-%s' % (hostname, n)))
+    await asyncio.gather(*[syncer.run() for syncer in syncers])
+
+
+if __name__ == '__main__':
+    if metrics_port:
+        metrics.serve(metrics_port)
+    asyncio.run(run_shards(shards or [{'key': filebeat_key}]))
@@ -0,0 +1,85 @@
+import re
+import time
+from collections import OrderedDict
+
+# leading time of a log line, e.g. '2021-06-01 12:00:00,123' or '[2021-06-01T12:00:00]'
+LEADING_TIME = re.compile(r'^\[?\d{4}[-/]\d{1,2}[-/]\d{1,2}[\sT:][\d:.,]*Z?\]?\s*')
+# values that differ between otherwise identical logs: uuids, hashes, hex and decimal numbers
+VARIABLE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\b[0-9a-f]{32,40}\b|'
+                      r'0x[0-9a-f]+|\d+', re.I)
+
+
+def normalize(line):
+    return VARIABLE.sub('#', LEADING_TIME.sub('', line.strip()))
+
+
+def fingerprint(service, message):
+    """Service plus the normalized first line, and for a traceback the
+    normalized exception line, which tells apart errors logged by the same call
+    """
+    lines = message.strip().split('\n')
+    key = service + '\n' + normalize(lines[0])
+    if len(lines) > 1 and 'Traceback' in message:
+        key += '\n' + normalize(lines[-1])
+    return key
+
+
+class LogAggregator(object):
+    """Collapse the rows of identical logs into one row with Count, First seen
+    and Last seen columns.
+
+    Rows are collected for at most `window` seconds and at most `max_keys`
+    distinct logs, whichever comes first, then flush() returns them.
+    """
+
+    def __init__(self, window=60, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self.rows = OrderedDict()
+        self.started = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, rows):
+        for row in rows:
+            # the Log cell is wrapped in a code fence
+            key = fingerprint(row['Service'], row['Log'][len('```\n'):-len('\n```')])
+            aggregated = self.rows.get(key)
+            if aggregated is None:
+                self.rows[key] = dict(row, **{'Count': 1, 'First seen': row['Time'], 'Last seen': row['Time']})
+            else:
+                aggregated['Count'] += 1
+                aggregated['First seen'] = min(aggregated['First seen'], row['Time'])
+                aggregated['Last seen'] = max(aggregated['Last seen'], row['Time'])
+        if self.rows and self.started is None:
+            self.started = time.time()
+
+    def remaining(self):
+        """Seconds until the window ends, None while nothing is collected
+        """
+        if self.started is None:
+            return None
+        return max(0, self.started + self.window - time.time())
+
+    def due(self):
+        return bool(self.rows) and (len(self.rows) >= self.max_keys or self.remaining() <= 0)
+
+    def flush(self):
+        rows = list(self.rows.values())
+        for row in rows:
+            row['Time'] = row['First seen']
+        self.clear()
+        return rows
+
+    def clear(self):
+        self.rows = OrderedDict()
+        self.started = None
+
+
+def aggregate(rows, max_keys=10000):
+    """Collapse identical logs within `rows` only
+    """
+    aggregator = LogAggregator(max_keys=max_keys)
+    aggregator.add(rows)
+    return aggregator.flush()
@@ -0,0 +1,94 @@
+import re
+from datetime import datetime
+
+# 2021-06-01 12:00:00, 2021-06-01T12:00:00, optionally in brackets
+ISO_PATTERN = re.compile(r'^\[?(\d{4}-\d{1,2}-\d{1,2})[\sT](\d{1,2}:\d{1,2}:\d{1,2})')
+# Jun  1 12:00:00
+SYSLOG_PATTERN = re.compile(r'^([A-Z][a-z]{2}\s+\d{1,2}\s\d{2}:\d{2}:\d{2})')
+# nginx access log: 1.2.3.4 - - [01/Jun/2021:12:00:00 +0000], error log: 2021/06/01 12:00:00
+NGINX_ACCESS_PATTERN = re.compile(r'^\S+ \S+ \S+ \[(\d{2}/[A-Z][a-z]{2}/\d{4}:\d{2}:\d{2}:\d{2})')
+NGINX_ERROR_PATTERN = re.compile(r'^(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})')
+# 1622548800000
+EPOCH_MILLIS_PATTERN = re.compile(r'^\[?(\d{13})\b')
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_iso(msg):
+    match = ISO_PATTERN.match(msg)
+    if match:
+        return match.group(1) + ' ' + match.group(2)
+
+
+def parse_syslog(msg):
+    match = SYSLOG_PATTERN.match(msg)
+    if match:
+        # syslog leaves out the year
+        now = datetime.now()
+        log_time = datetime.strptime('%s %s' % (now.year, match.group(1)), '%Y %b %d %H:%M:%S')
+        if log_time > now:
+            log_time = log_time.replace(year=now.year - 1)
+        return log_time.strftime(TIME_FORMAT)
+
+
+def parse_nginx(msg):
+    match = NGINX_ACCESS_PATTERN.match(msg)
+    if match:
+        return datetime.strptime(match.group(1), '%d/%b/%Y:%H:%M:%S').strftime(TIME_FORMAT)
+    match = NGINX_ERROR_PATTERN.match(msg)
+    if match:
+        return match.group(1).replace('/', '-')
+
+
+def parse_epoch_millis(msg):
+    match = EPOCH_MILLIS_PATTERN.match(msg)
+    if match:
+        return datetime.fromtimestamp(int(match.group(1)) / 1000).strftime(TIME_FORMAT)
+
+
+PARSERS = {
+    'iso': parse_iso,
+    'syslog': parse_syslog,
+    'nginx': parse_nginx,
+    'epoch_millis': parse_epoch_millis,
+}
+
+
+def make_parser(pattern, time_format):
+    """Parser for a user defined format: the first group of `pattern` is
+    read with the strptime `time_format`
+    """
+    pattern = re.compile(pattern)
+
+    def parse(msg):
+        match = pattern.match(msg)
+        if match:
+            return datetime.strptime(match.group(1), time_format).strftime(TIME_FORMAT)
+    return parse
+
+
+class TimestampParser(object):
+    """Extract the time of a log message in a single pass per format and
+    normalize it to '%Y-%m-%d %H:%M:%S'.
+
+    `formats` are tried after the iso formats of the SeaTable logs, either the
+    name of a parser in PARSERS or a (regex, strptime format) tuple.
+    """
+
+    def __init__(self, formats=()):
+        self.parsers = [parse_iso]
+        for log_format in formats:
+            if isinstance(log_format, str):
+                self.parsers.append(PARSERS[log_format])
+            else:
+                self.parsers.append(make_parser(*log_format))
+
+    def parse(self, msg):
+        for parser in self.parsers:
+            try:
+                log_time = parser(msg)
+            except ValueError:
+                continue
+            if log_time:
+                return log_time
+        return None
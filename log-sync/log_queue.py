@@ -0,0 +1,137 @@
+"""
+The redis side of the log syncers, shared by log_syncer and async_log_syncer.
+
+With reliable delivery the logs are moved with LMOVE from the filebeat list
+into a processing list of the worker and only removed once they are
+inserted. Workers keep a heartbeat key alive, the processing lists of
+workers whose heartbeat expired are re-queued by the others.
+
+The async syncer keeps one processing list per insert in flight,
+'<processing key>/<slot>', and passes it as `processing_key`.
+"""
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_common import metrics
+
+from settings import batch_max_rows, batch_linger, idle_timeout, reliable_delivery, heartbeat_timeout
+
+DEAD_LOGS = metrics.counter('log_sync_dead_logs_total', 'Logs moved to the dead list')
+
+
+class LogQueue(object):
+
+    def __init__(self, r, key, worker_id, reliable=reliable_delivery):
+        self.r = r
+        self.key = key
+        self.worker_id = worker_id
+        self.reliable = reliable
+        self.processing_key = '%s:processing:%s' % (key, worker_id)
+        self.heartbeat_key = '%s:heartbeat:%s' % (key, worker_id)
+        self.dead_key = '%s:dead' % key
+        self.batch_max_rows = batch_max_rows
+        self.batch_linger = batch_linger
+        self.idle_timeout = idle_timeout
+        self.last_reap = 0
+
+    def count(self):
+        return self.r.llen(self.key)
+
+    @metrics.timed('redis_pop')
+    def pop(self, count, processing_key=None):
+        if not self.reliable:
+            return self.r.lpop(self.key, count) or []
+        count = min(count, self.r.llen(self.key))
+        if count <= 0:
+            return []
+        pipe = self.r.pipeline(transaction=False)
+        for _ in range(count):
+            pipe.lmove(self.key, processing_key or self.processing_key, 'LEFT', 'RIGHT')
+        return [log for log in pipe.execute() if log is not None]
+
+    def blocking_pop(self, timeout, processing_key=None):
+        if not self.reliable:
+            item = self.r.blpop(self.key, timeout=timeout)
+            return item[1] if item else None
+        return self.r.blmove(self.key, processing_key or self.processing_key, timeout, 'LEFT', 'RIGHT')
+
+    def pending(self, processing_key=None):
+        """Logs that were popped but not acknowledged, e.g. because the insert
+        failed or the process stopped
+        """
+        if not self.reliable:
+            return []
+        return self.r.lrange(processing_key or self.processing_key, 0, -1)
+
+    def ack(self, processing_key=None):
+        if self.reliable:
+            self.r.delete(processing_key or self.processing_key)
+
+    def move_to_dead(self, logs, processing_key=None, ack=True):
+        """Move `logs` to the dead list, with `ack` out of the processing list
+        """
+        if not logs:
+            return
+        pipe = self.r.pipeline()
+        pipe.rpush(self.dead_key, *logs)
+        if self.reliable and ack:
+            pipe.delete(processing_key or self.processing_key)
+        pipe.execute()
+        DEAD_LOGS.inc(len(logs), queue=self.key)
+
+    def heartbeat(self):
+        if self.reliable:
+            self.r.set(self.heartbeat_key, str(datetime.now()), ex=heartbeat_timeout)
+
+    def reap(self):
+        """Re-queue the processing lists of workers whose heartbeat expired,
+        at the head of the list so they are the next logs to be synced
+        """
+        if not self.reliable or time.time() - self.last_reap < heartbeat_timeout:
+            return
+        self.last_reap = time.time()
+        prefix = '%s:processing:' % self.key
+        for key in self.r.scan_iter(match=prefix + '*'):
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            # the async syncer keeps one processing list per slot: <worker>/<slot>
+            worker = key[len(prefix):].split('/')[0]
+            if worker == self.worker_id or self.r.exists('%s:heartbeat:%s' % (self.key, worker)):
+                continue
+            count = 0
+            while self.r.lmove(key, self.key, 'RIGHT', 'LEFT') is not None:
+                count += 1
+            logging.warning('re-queue %s logs of stopped worker %s', count, worker)
+
+    def next_batch(self, processing_key=None, max_wait=None):
+        """Collect up to batch_max_rows logs. A deep list is drained at full
+        speed, a started batch waits at most batch_linger seconds for more
+        logs and an empty list is waited on with BLPOP instead of polling,
+        for at most `max_wait` seconds when given.
+        """
+        logs = []
+        deadline = None
+        while len(logs) < self.batch_max_rows:
+            popped = self.pop(self.batch_max_rows - len(logs), processing_key)
+            if not popped:
+                if deadline is None:
+                    timeout = self.idle_timeout
+                    if max_wait is not None:
+                        if max_wait <= 0:
+                            break
+                        timeout = min(timeout, max_wait)
+                else:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                log = self.blocking_pop(timeout, processing_key)
+                if log is None:
+                    break
+                popped = [log]
+            logs.extend(popped)
+            if deadline is None:
+                deadline = time.time() + self.batch_linger
+        return logs
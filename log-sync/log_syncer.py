@@ -1,109 +1,347 @@
 #!/usr/bin/env python3
 
-import re
+import os
+import sys
 import time
 import json
+import socket
+import calendar
 import logging
+import threading
 import redis
 from datetime import datetime
 from seatable_api import Base
 
-from settings import server_url, api_token, table_name, filebeat_key, \
-    redis_host, redis_port, redis_db, redis_password
-
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sync_common import metrics
+from sync_common.scheduler import RequestScheduler, CircuitOpenError, backoff, get_scheduler, get_status, \
+    is_retryable
 
-DATETIME_MATCH_1 = r'^(\d{4}-\d{1,2}-\d{1,2}\s\d{1,2}:\d{1,2}:\d{1,2})'
-DATETIME_MATCH_2 = r'^(\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2})'
-DATETIME_MATCH_3 = r'^\[(\d{4}-\d{1,2}-\d{1,2}\s\d{1,2}:\d{1,2}:\d{1,2})'
-DATETIME_MATCH_4 = r'^\[(\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2})'
+from log_aggregator import LogAggregator, aggregate
+from log_parser import TimestampParser
+from log_queue import LogQueue
+from rate_limiter import get_server_limiter
+from spill_store import SpillStore
+from settings import server_url, api_token, table_name, filebeat_key, \
+    redis_host, redis_port, redis_db, redis_password, log_time_formats, \
+    reliable_delivery, worker_id, max_delivery_attempts, shards, max_requests_per_second, aggregate_window, aggregate_max_keys, \
+    spill_dir, spill_segment_bytes, spill_max_bytes, spill_replay_rows, spill_probe_interval, \
+    metrics_port, metrics_interval, request_max_retries, circuit_failure_threshold, circuit_reset_timeout
 
 logging.basicConfig(
-    format="[%(asctime)s] [%(levelname)s] %(name)s %(filename)s:%(lineno)s %(funcName)s %(message)s",
+    format="[%(asctime)s] [%(levelname)s] [%(threadName)s] %(name)s %(filename)s:%(lineno)s %(funcName)s %(message)s",
     level=logging.INFO
 )
 
 
+SPILL_BYTES = metrics.gauge('log_sync_spill_bytes', 'Bytes of logs in the spill store')
+SPILL_AGE = metrics.gauge('log_sync_spill_oldest_seconds', 'Seconds since the oldest log in the spill store was spilled')
+
+
+@metrics.timed('parse')
+def get_rows(logs, timestamp_parser):
+    """Convert filebeat logs to rows of the log table
+    """
+    rows = []
+    for log in logs:
+        try:
+            logs = json.loads(log)
+        except ValueError:
+            logging.warning('invalid log: %s', log)
+            continue
+        msg = logs['message']
+        log_time = timestamp_parser.parse(msg) or str(datetime.now())
+        msg = '```\n' + msg + '\n```'
+        service = '-'.join(logs['tags'])
+        logging.debug('service: %s', service)
+
+        row_data = {
+            'Service': service,
+            'Time': log_time,
+            'Log': msg
+        }
+        rows.append(row_data)
+    return rows
+
+
+def get_lag(log):
+    """Seconds since filebeat read `log`, None when it has no @timestamp
+    """
+    try:
+        timestamp = json.loads(log)['@timestamp']
+        # filebeat timestamps are UTC, e.g. 2021-06-01T12:00:00.123Z
+        return time.time() - calendar.timegm(time.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S'))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def is_outage(e):
+    """Whether an insert error means that SeaTable is unavailable, rather than
+    that it rejected the logs: a network error, an error status of the server,
+    a throttled or unauthorized request or an open circuit
+    """
+    return isinstance(e, CircuitOpenError) or is_retryable(e) or get_status(e) in (401, 403)
+
+
 class LogSyncer(object):
 
-    def __init__(self):
-        self.base = Base(api_token, server_url)
-        self.r = redis.Redis(
+    def __init__(self, base=None, r=None, key=filebeat_key, table=table_name, worker_name=None, scheduler=None):
+        self.base = base or Base(api_token, server_url)
+        self.r = r or redis.Redis(
             host=redis_host, port=redis_port, db=redis_db, password=redis_password)
-        self.batch_count = 10
-        self.wait_timout = 30
+        self.key = key
+        self.table_name = table
+        self.scheduler = scheduler or RequestScheduler(
+            max_retries=request_max_retries, failure_threshold=circuit_failure_threshold,
+            reset_timeout=circuit_reset_timeout)
+        self.timestamp_parser = TimestampParser(log_time_formats)
 
-    def now(self):
-        return str(datetime.now())
+        # reliable delivery moves the logs into a processing list of this
+        # worker and only removes them once they are inserted
+        self.reliable = reliable_delivery
+        self.worker_id = worker_name or worker_id or socket.gethostname()
+        self.queue = LogQueue(self.r, self.key, self.worker_id, reliable=self.reliable)
+        self.attempts = 0
+        self.errors = 0
+        # check for unacknowledged logs of a previous run first
+        self.retry = True
+
+        self.aggregator = LogAggregator(aggregate_window, aggregate_max_keys) if aggregate_window else None
+
+        # during an outage logs are drained from redis to the spill store
+        self.spill = None
+        if spill_dir:
+            self.spill = SpillStore(os.path.join(spill_dir, '%s-%s' % (self.key, self.worker_id)),
+                                    segment_bytes=spill_segment_bytes, max_bytes=spill_max_bytes)
+        self.outage = False
+        self.last_probe = 0
+        self.last_report = 0
 
     def count(self):
-        return self.r.llen(filebeat_key)
+        return self.queue.count()
 
     def base_auth(self):
         while True:
             try:
+                self.queue.heartbeat()
                 self.base.auth()
                 break
             except Exception as e:
                 logging.exception(e)
-                time.sleep(30)
+                self.pause()
+
+    def pause(self):
+        """Back off after an error, the longer the more errors in a row
+        """
+        self.errors += 1
+        time.sleep(backoff(self.errors, base_delay=1, max_delay=60))
+
+    def ack(self):
+        self.attempts = 0
+        self.queue.ack()
+
+    def fail(self, e):
+        """Count a failed delivery, a batch that SeaTable keeps rejecting is
+        moved to the dead list so that it does not block the logs behind it.
+        While SeaTable is unavailable the batch is retried without counting.
+        """
+        self.retry = True
+        metrics.RETRIES.inc(reason='insert', queue=self.key)
+        if is_outage(e):
+            return
+        self.attempts += 1
+        if not self.reliable or self.attempts < max_delivery_attempts:
+            return
+        logs = self.queue.pending()
+        if logs:
+            logging.error('move %s logs to %s after %s failed attempts', len(logs), self.queue.dead_key, self.attempts)
+            self.queue.move_to_dead(logs)
+        self.attempts = 0
+
+    def report(self):
+        """Update the queue depth and spill gauges every metrics_interval seconds
+        """
+        if time.time() - self.last_report < metrics_interval:
+            return
+        self.last_report = time.time()
+        metrics.QUEUE_DEPTH.set(self.count(), queue=self.key)
+        if self.spill is not None:
+            SPILL_BYTES.set(self.spill.size, queue=self.key, worker=self.worker_id)
+            SPILL_AGE.set(self.spill.oldest_age(), queue=self.key, worker=self.worker_id)
+
+    def take_logs(self):
+        """The unacknowledged logs to retry, or else the next batch
+        """
+        logs = []
+        if self.retry:
+            # retry the logs of a failed insert before taking new ones,
+            # they are aggregated again from the processing list
+            self.retry = False
+            if self.reliable and self.aggregator is not None:
+                self.aggregator.clear()
+            logs = self.queue.pending()
+        # do not wait past the end of the aggregation window
+        max_wait = self.aggregator.remaining() if self.aggregator is not None else None
+        return logs or self.queue.next_batch(max_wait=max_wait)
+
+    def insert(self, rows):
+        if rows:
+            with metrics.timed('insert'):
+                self.scheduler.call(self.base.big_data_insert_rows, self.table_name, rows)
+            metrics.ROWS.inc(len(rows), table=self.table_name)
+            metrics.BATCH_ROWS.observe(len(rows), table=self.table_name)
 
     def send(self, logs):
-        rows = []
-        for log in logs:
-            logs = json.loads(log)
-            msg = logs['message']
-            if re.match(DATETIME_MATCH_1, msg):
-                log_time = re.match(DATETIME_MATCH_1, msg).group(1)
-            elif re.match(DATETIME_MATCH_2, msg):
-                log_time = re.match(DATETIME_MATCH_2, msg).group(1).replace('T', ' ')
-            elif re.match(DATETIME_MATCH_3, msg):
-                log_time = re.match(DATETIME_MATCH_3, msg).group(1)
-            elif re.match(DATETIME_MATCH_4, msg):
-                log_time = re.match(DATETIME_MATCH_4, msg).group(1).replace('T', ' ')
+        """Insert the rows of `logs` and return whether all logs received so
+        far are written. With aggregation the rows are held until the window ends.
+        """
+        rows = get_rows(logs, self.timestamp_parser)
+        if self.aggregator is not None:
+            self.aggregator.add(rows)
+            if not self.aggregator.due():
+                return False
+            rows = self.aggregator.flush()
+        self.insert(rows)
+        lag = get_lag(logs[-1]) if logs else None
+        if lag is not None:
+            metrics.LAG.set(lag, queue=self.key)
+        return True
+
+    def enter_outage(self, e):
+        """Switch to spilling the logs to disk if `e` means SeaTable is unavailable
+        """
+        if self.spill is None or not is_outage(e):
+            return False
+        if not self.outage:
+            logging.warning('SeaTable is unavailable (%s), spill logs to %s', e, self.spill.path)
+            self.outage = True
+            self.last_probe = time.time()
+        self.retry = True
+        return True
+
+    def drain(self):
+        """During an outage, move the logs from redis to the spill store and
+        check every spill_probe_interval seconds whether SeaTable is back
+        """
+        logs = self.take_logs()
+        if logs:
+            if self.spill.append(logs):
+                self.ack()
             else:
-                log_time = self.now()
-            msg = '```\n' + msg + '\n```'
-            service = '-'.join(logs['tags'])
-            logging.info('service: %s', service)
-
-            row_data = {
-                'Service': service,
-                'Time': log_time,
-                'Log': msg
-            }
-            rows.append(row_data)
-        self.base.big_data_insert_rows(table_name, rows)
+                # the logs stay in redis until there is room again
+                logging.warning('spill store %s is full', self.spill.path)
+                self.retry = True
+                time.sleep(spill_probe_interval)
+        if time.time() - self.last_probe < spill_probe_interval:
+            return
+        self.last_probe = time.time()
+        logging.info('spilled %s bytes, the oldest log was spilled %.0fs ago',
+                     self.spill.size, self.spill.oldest_age())
+        self.base.auth()
+        self.replay()
+        self.outage = False
+        logging.info('SeaTable is available again, replay the spilled logs')
+
+    def replay(self):
+        """Insert one batch of spilled logs, the logs SeaTable rejects go to the dead list
+        """
+        logs, position = self.spill.read(spill_replay_rows)
+        if position is None:
+            return
+        rows = get_rows(logs, self.timestamp_parser)
+        if self.aggregator is not None:
+            rows = aggregate(rows, aggregate_max_keys)
+        try:
+            self.insert(rows)
+        except Exception as e:
+            if is_outage(e):
+                raise
+            logging.error('move %s spilled logs to %s: %s', len(logs), self.queue.dead_key, e)
+            self.queue.move_to_dead(logs, ack=False)
+        self.spill.commit(position)
 
     def start(self):
-        logging.info('Logs count: %s', self.count())
+        logging.info('%s logs count: %s', self.key, self.count())
         self.base.auth()
 
         while True:
             try:
-                start = time.time()
-                while True:
-                    if self.r.llen(filebeat_key) > self.batch_count or time.time() - start > self.wait_timout:
-                        break
-                    time.sleep(5)
-                logs = self.r.lpop(filebeat_key, self.batch_count)
-                if not logs:
-                    time.sleep(30)
+                self.queue.heartbeat()
+                self.queue.reap()
+                self.report()
+                if self.outage:
+                    self.drain()
                     continue
-
-                self.send(logs)
-                time.sleep(0.5)
+                if self.spill is not None and len(self.spill):
+                    # catch up on the spilled logs between the new batches
+                    self.replay()
+                logs = self.take_logs()
+                if not logs and not (self.aggregator is not None and self.aggregator.due()):
+                    continue
+                if self.send(logs):
+                    self.ack()
+                self.errors = 0
             except ConnectionError as e:
+                if self.enter_outage(e):
+                    continue
                 logging.exception('connection error: %s', e)
-                time.sleep(30)
+                self.fail(e)
+                self.pause()
                 self.base_auth()
             except redis.exceptions.ConnectionError as e:
                 logging.exception('redis error: %s', e)
-                time.sleep(30)
+                metrics.RETRIES.inc(reason='redis', queue=self.key)
+                self.retry = True
+                self.pause()
             except Exception as e:
+                if self.enter_outage(e):
+                    continue
                 logging.exception(e)
-                time.sleep(30)
+                self.fail(e)
+                self.pause()
+
+
+def run_workers(shard_list):
+    """Run the workers of every shard on threads. Each shard is a redis key,
+    the workers of shards that target the same server share one request
+    scheduler, with the rate limit of all hosts.
+    """
+    r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password)
+    hostname = worker_id or socket.gethostname()
+    bases = {}
+    threads = []
+    total_workers = sum(shard.get('workers', 1) for shard in shard_list)
+    for shard in shard_list:
+        shard_server_url = shard.get('server_url', server_url)
+        shard_api_token = shard.get('api_token', api_token)
+        if (shard_server_url, shard_api_token) not in bases:
+            bases[(shard_server_url, shard_api_token)] = Base(shard_api_token, shard_server_url)
+        scheduler = get_scheduler(
+            shard_server_url,
+            max_in_flight=total_workers,
+            max_retries=request_max_retries,
+            failure_threshold=circuit_failure_threshold,
+            reset_timeout=circuit_reset_timeout,
+            limiter=get_server_limiter(r, shard_server_url, max_requests_per_second))
+
+        workers = shard.get('workers', 1)
+        for n in range(workers):
+            log_syncer = LogSyncer(
+                base=bases[(shard_server_url, shard_api_token)],
+                r=r,
+                key=shard['key'],
+                table=shard.get('table_name', table_name),
+                worker_name=hostname if workers == 1 else '%s-%s' % (hostname, n),
+                scheduler=scheduler)
+            thread = threading.Thread(target=log_syncer.start, name='%s-%s' % (shard['key'], n), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(1)
 
 
 if __name__ == '__main__':
-    log_syncer = LogSyncer()
-    log_syncer.start()
+    if metrics_port:
+        metrics.serve(metrics_port)
+    run_workers(shards or [{'key': filebeat_key}])
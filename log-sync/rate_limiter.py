@@ -0,0 +1,33 @@
+import time
+
+
+class RateLimiter(object):
+    """Limit requests per second across all workers, on all hosts, that
+    share the redis `key`: the requests of every second are counted in redis
+    and a worker over the limit waits for the next second.
+    """
+
+    def __init__(self, r, key, rate):
+        self.r = r
+        self.key = key
+        self.rate = rate
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.time()
+            window_key = '%s:%s' % (self.key, int(now))
+            pipe = self.r.pipeline()
+            pipe.incr(window_key)
+            pipe.expire(window_key, 2)
+            count = pipe.execute()[0]
+            if count <= self.rate:
+                return
+            time.sleep(int(now) + 1 - now)
+
+
+def get_server_limiter(r, server_url, rate):
+    """The limiter shared by all workers, threaded or async, that insert into `server_url`
+    """
+    return RateLimiter(r, 'log-syncer:rate:%s' % server_url, rate)
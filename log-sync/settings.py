@@ -11,6 +11,59 @@ redis_password = None
 
 filebeat_key = 'seatable-error-logs'
 
+# batching
+batch_max_rows = 1000  # max logs per insert request
+batch_linger = 2  # max seconds a started batch waits for more logs
+idle_timeout = 30  # seconds a BLPOP waits on an empty list
+
+# reliable delivery: logs stay in a processing list of the worker until they
+# are inserted, the lists of workers without heartbeat are re-queued
+reliable_delivery = True
+worker_id = ''  # unique per worker, default the hostname
+heartbeat_timeout = 120  # seconds, should be well above idle_timeout
+max_delivery_attempts = 5  # inserts SeaTable rejects, then the batch is moved to '<filebeat_key>:dead'
+
+# shards: redis keys synced by their own workers, by default only filebeat_key.
+# A shard can set 'workers' and its own 'table_name', 'server_url' and 'api_token', e.g.
+# shards = [
+#     {'key': 'seatable-error-logs-dtable-server', 'workers': 2},
+#     {'key': 'seatable-error-logs-dtable-web', 'table_name': 'dtable-web logs'},
+# ]
+shards = []
+# insert requests per second to a server, shared by all workers of all hosts, 0 for no limit
+max_requests_per_second = 5
+# failed inserts are retried after the server's Retry-After or a jittered
+# backoff; after circuit_failure_threshold failures in a row the inserts are
+# stopped for circuit_reset_timeout seconds
+request_max_retries = 3
+circuit_failure_threshold = 5
+circuit_reset_timeout = 30
+
+# aggregation: identical logs within aggregate_window seconds are written as one
+# row with Count, First seen and Last seen columns, 0 to write every log
+aggregate_window = 0
+aggregate_max_keys = 10000  # distinct logs held before the window is flushed early
+
+# spill: while SeaTable is unavailable the logs are moved from redis to local
+# files and replayed once it is back, empty to leave them in redis
+spill_dir = ''
+spill_segment_bytes = 4 * 1024 * 1024
+spill_max_bytes = 1024 * 1024 * 1024  # when full the logs stay in redis
+spill_replay_rows = 5000  # logs per replayed insert request
+spill_probe_interval = 30  # seconds between checks whether SeaTable is back
+
+# metrics: Prometheus text format on http://<host>:<metrics_port>/metrics, 0 to not serve them
+metrics_port = 0
+metrics_interval = 10  # seconds between updates of the queue depth and spill gauges
+
+# async_log_syncer.py: insert requests in flight per shard
+async_max_in_flight = 4
+
+# extra log time formats, tried after the formats of the SeaTable logs:
+# 'syslog', 'nginx', 'epoch_millis' or (regex, strptime format) tuples, e.g.
+# [(r'^(\d{2}\.\d{2}\.\d{4} \d{2}:\d{2}:\d{2})', '%d.%m.%Y %H:%M:%S')]
+log_time_formats = []
+
 try:
     from log_syncer_settings import *
 except:
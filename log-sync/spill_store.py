@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import logging
+
+
+class SpillStore(object):
+    """Append-only store of logs on local disk, used while SeaTable is unavailable.
+
+    Logs are written as JSON lines, {"time": spill time, "log": filebeat log},
+    to segment files of about `segment_bytes` each, with one fsync per
+    appended batch. Segments are replayed oldest first; the replay position in
+    a segment is kept in a '.pos' file next to it and a segment is removed
+    once it is replayed completely.
+
+    A line without its newline, left by a crash during a write, is cut off
+    when the store is opened again; lines that are not valid records are
+    skipped with a warning.
+    """
+
+    def __init__(self, path, segment_bytes=4 * 1024 * 1024, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(os.path.join(path, name) for name in os.listdir(path)
+                               if name.startswith('spill-') and name.endswith('.jsonl'))
+        if self.segments:
+            self._truncate(self.segments[-1])
+        self.size = sum(os.path.getsize(segment) for segment in self.segments)
+        self.writer = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _new_segment(self):
+        seq = int(os.path.basename(self.segments[-1])[6:-6]) + 1 if self.segments else 0
+        segment = os.path.join(self.path, 'spill-%012d.jsonl' % seq)
+        self.segments.append(segment)
+        self.writer = open(segment, 'ab')
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def append(self, logs):
+        """Write `logs` and fsync them, return False when the store is full
+        """
+        now = time.time()
+        data = b''.join(json.dumps({
+            'time': now,
+            'log': log.decode('utf-8') if isinstance(log, bytes) else log,
+        }).encode('utf-8') + b'\n' for log in logs)
+        if self.size + len(data) > self.max_bytes:
+            return False
+        if self.writer is None or self.writer.tell() >= self.segment_bytes:
+            self._close_writer()
+            self._new_segment()
+        self.writer.write(data)
+        self.writer.flush()
+        os.fsync(self.writer.fileno())
+        self.size += len(data)
+        return True
+
+    def _truncate(self, segment):
+        """Cut off a partly written last line
+        """
+        with open(segment, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                logging.warning('cut off %s bytes of a partly written log in %s', len(data) - end, segment)
+                f.truncate(end)
+
+    def _records(self, f):
+        """The records of `f` from its position, skipping the invalid ones
+        """
+        while True:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                return
+            try:
+                record = json.loads(line)
+                record['log'], record['time']
+            except (ValueError, TypeError, KeyError) as e:
+                logging.warning('skip invalid spilled log in %s: %s', f.name, e)
+                continue
+            yield record
+
+    def _offset(self, segment):
+        try:
+            with open(segment + '.pos') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def read(self, max_rows):
+        """Return up to `max_rows` of the oldest logs and their position, to
+        pass to commit() once they are inserted
+        """
+        if not self.segments:
+            return [], None
+        segment = self.segments[0]
+        if self.writer is not None and self.writer.name == segment:
+            # new logs go to the next segment, this one can be replayed completely
+            self._close_writer()
+        logs = []
+        end, eof = None, True
+        with open(segment, 'rb') as f:
+            f.seek(self._offset(segment))
+            for record in self._records(f):
+                logs.append(record['log'])
+                if len(logs) >= max_rows:
+                    end = f.tell()
+                    eof = not f.readline()
+                    break
+        return logs, (segment, end, eof)
+
+    def commit(self, position):
+        segment, end, eof = position
+        if not eof:
+            with open(segment + '.pos.tmp', 'w') as f:
+                f.write(str(end))
+            os.replace(segment + '.pos.tmp', segment + '.pos')
+            return
+        self.size -= os.path.getsize(segment)
+        os.remove(segment)
+        if os.path.exists(segment + '.pos'):
+            os.remove(segment + '.pos')
+        self.segments.remove(segment)
+
+    def oldest_age(self):
+        """Seconds since the oldest log in the store was spilled, 0 when empty
+        """
+        if not self.segments:
+            return 0
+        segment = self.segments[0]
+        with open(segment, 'rb') as f:
+            f.seek(self._offset(segment))
+            record = next(self._records(f), None)
+        return time.time() - record['time'] if record else 0
@@ -0,0 +1,193 @@
+"""
+Metrics of the syncers in the Prometheus text format, served by serve().
+
+The metrics are kept in process, recording one costs a lock and a few
+additions, so they are recorded whether or not the endpoint is served.
+
+    from sync_common import metrics
+
+    metrics.serve(9100)
+
+    @metrics.timed('parse')
+    def get_rows(logs):
+        ...
+
+    with metrics.timed('insert'):
+        base.big_data_insert_rows(table_name, rows)
+    metrics.ROWS.inc(len(rows), table=table_name)
+"""
+import time
+import bisect
+import logging
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                          .replace('\n', r'\n')) for name, value in labels)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append('%s%s %s' % (self.name, _format_labels(labels), value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            # per label set: a count per bucket, the sum and the count
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            for labels, (bucket_counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket%s %s' % (self.name, _format_labels(labels + (('le', bound),)), cumulative))
+                lines.append('%s_sum%s %s' % (self.name, _format_labels(labels), total))
+                lines.append('%s_count%s %s' % (self.name, _format_labels(labels), count))
+        return lines
+
+
+def _register(cls, name, *args):
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = cls(name, *args)
+        return _registry[name]
+
+
+def counter(name, help):
+    return _register(Counter, name, help)
+
+
+def gauge(name, help):
+    return _register(Gauge, name, help)
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    return _register(Histogram, name, help, buckets)
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+# shared by the syncers, every process serves its own endpoint
+ROWS = counter('sync_rows_total', 'Rows written to SeaTable, rate() for rows per second')
+BATCH_ROWS = histogram('sync_batch_rows', 'Rows per write request', SIZE_BUCKETS)
+STAGE_SECONDS = histogram('sync_stage_seconds', 'Duration of the hot path stages')
+RETRIES = counter('sync_retries_total', 'Retried requests and batches')
+QUEUE_DEPTH = gauge('sync_queue_depth', 'Items waiting to be synced')
+LAG = gauge('sync_lag_seconds', 'Age of the newest synced item when it was written')
+
+
+class timed(object):
+    """Record the duration of a stage in STAGE_SECONDS, as a decorator or a
+    context manager
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.local = threading.local()
+
+    def __enter__(self):
+        self.local.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        STAGE_SECONDS.observe(time.perf_counter() - self.local.start, stage=self.stage)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=self.stage)
+        return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='0.0.0.0'):
+    """Serve /metrics on a daemon thread and return the server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info('serve metrics on %s:%s', host, port)
+    return server
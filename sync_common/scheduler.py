@@ -0,0 +1,242 @@
+"""
+Scheduling of the requests to a SeaTable server, shared by the syncers.
+
+RequestScheduler.call() runs one request within a token bucket and a limit
+of requests in flight and retries it when the server is unavailable or
+throttles it: after the Retry-After of a 429, else after an exponential
+backoff with jitter. Consecutive failures open a circuit breaker, then
+requests fail fast with CircuitOpenError until a trial request succeeds;
+throttled requests do not count as failures.
+
+A request that must not be sent twice, e.g. an append, is called with
+idempotent=False: it is only retried after a 429, a timeout or server error
+might have come after the rows were written and is raised to the caller.
+
+    scheduler = get_scheduler(server_url, rate=10)
+    scheduler.call(base.batch_append_rows, table_name, rows, idempotent=False)
+"""
+import re
+import time
+import random
+import logging
+import threading
+
+from sync_common import metrics
+
+logger = logging.getLogger(__name__)
+
+# django rest framework throttling, e.g. 'Request was throttled. Expected available in 12 seconds.'
+THROTTLED_MESSAGE = re.compile(r'available in (\d+(?:\.\d+)?) seconds?')
+
+CIRCUIT_OPEN = metrics.counter('sync_circuit_open_total', 'Times a circuit breaker opened')
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending a request while the circuit breaker is open
+    """
+
+
+def get_status(e):
+    """HTTP status of a request error, None for a network error. seatable_api
+    raises ConnectionError(status_code, text), requests and aiohttp errors
+    carry the status on the response or the error.
+    """
+    response = getattr(e, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return response.status_code
+    if isinstance(getattr(e, 'status', None), int):
+        return e.status
+    # an int below 400 is the errno of an OSError
+    if isinstance(e, OSError) and e.args and isinstance(e.args[0], int) and 400 <= e.args[0] < 600:
+        return e.args[0]
+    return None
+
+
+def is_retryable(e):
+    """Whether the request may succeed when it is sent again: a network error,
+    a server error or a throttled request
+    """
+    if isinstance(e, CircuitOpenError):
+        return False
+    status = get_status(e)
+    if status is None:
+        return isinstance(e, (OSError, TimeoutError))
+    return status >= 500 or status == 429
+
+
+def get_retry_after(e):
+    """Seconds the server asks to wait before the next request, None if it does not say
+    """
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(e, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if value is None:
+        match = THROTTLED_MESSAGE.search(' '.join(str(arg) for arg in e.args))
+        value = match.group(1) if match else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        # an HTTP date instead of seconds
+        return None
+
+
+def backoff(attempt, base_delay=0.5, max_delay=60):
+    """Exponential backoff with full jitter, `attempt` counts from 1
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class TokenBucket(object):
+    """`rate` requests per second on average and bursts of up to `burst`
+    requests, 0 for no limit
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Hold back every request for `seconds`, e.g. after a 429
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def paused_for(self):
+        with self.lock:
+            return max(0, self.paused_until - time.monotonic())
+
+    def _wait_time(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if not self.rate:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                wait = self._wait_time()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class CircuitBreaker(object):
+    """Open after `failure_threshold` consecutive failures; while open one
+    trial request is let through every `reset_timeout` seconds and its
+    success closes the breaker
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.opened_at = time.monotonic()
+            return True
+
+    def success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info('circuit closed')
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                logger.warning('circuit opened after %s failures', self.failures)
+                CIRCUIT_OPEN.inc()
+                self.opened_at = time.monotonic()
+
+
+class RequestScheduler(object):
+    """Token bucket, requests in flight, retries and circuit breaker of one
+    server. `limiter` is acquired after the token bucket, e.g. a limit
+    shared between hosts; it needs an acquire() method.
+    """
+
+    def __init__(self, rate=0, burst=None, max_in_flight=4, max_retries=5, base_delay=0.5, max_delay=60,
+                 failure_threshold=5, reset_timeout=30, limiter=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = limiter
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def retry_delay(self, e, attempt):
+        """Seconds to wait before retrying after `e`, None when it should not
+        be retried. A Retry-After also holds back the other requests.
+        """
+        if not is_retryable(e):
+            return None
+        retry_after = get_retry_after(e)
+        if retry_after is not None:
+            self.bucket.pause(retry_after)
+            return retry_after
+        return backoff(attempt, self.base_delay, self.max_delay)
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError('circuit open, the server failed %s times in a row' % self.breaker.failures)
+            self.bucket.acquire()
+            if self.limiter is not None:
+                self.limiter.acquire()
+            with self.slots:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    attempt += 1
+                    delay = self.retry_delay(e, attempt)
+                    if delay is None:
+                        # the server answered, it is up
+                        self.breaker.success()
+                        raise
+                    throttled = get_status(e) == 429
+                    if not throttled:
+                        self.breaker.failure()
+                    if attempt > self.max_retries or not (idempotent or throttled):
+                        raise
+                    metrics.RETRIES.inc(reason=str(get_status(e) or 'network'))
+                    logger.warning('request error: %s, retry %s after %.2fs', e, attempt, delay)
+                else:
+                    self.breaker.success()
+                    return result
+            time.sleep(delay)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(key, **kwargs):
+    """The scheduler of `key`, e.g. a server url or base, created with
+    `kwargs` on first use so that all callers of a server share it
+    """
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler(**kwargs)
+        return _schedulers[key]